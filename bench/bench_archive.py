@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Times the archive and thumbnail path over a library: books/sec, p50/p95
+per-book latency and peak RSS, for
+
+  thumb    archive.extract_thumb() on one book after another
+  extract  archive.extract_archive() of every page, one book after another
+  job      comic_db.do_thumb_job() on a freshly scanned db (the real thing,
+           workers and all, see -e and -w)
+
+    python3 bench/bench_archive.py [-n 100] [-p 24] [-s 1] [-e process] [-w 4]
+                                   [-m thumb,extract,job] [comic dir]
+
+Without a comic dir, a library is generated with gen_corpus.py (same -n, -p
+and -s, so the numbers are comparable from one run to the next).  Every
+mode is run in its own interpreter, so the peak RSS is its own.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
+
+from gen_corpus import make_corpus
+from benchutil import list_comics, pool_pids, PeakRss
+
+MODES = ['thumb', 'extract', 'job']
+LADDER = [(300, 400), (600, 800), (150, 200), (75, 100)]
+
+
+def timed_extract_thumb(crl):
+    """ extract_thumb(), with how long it took added to the result. """
+    from gazee.archive import extract_thumb
+    st = time.perf_counter()
+    edict = extract_thumb(crl)
+    if edict is not None:
+        edict['bench_secs'] = time.perf_counter() - st
+    return edict
+
+
+def run_thumb(comics, workdir):
+    from gazee.archive import extract_thumb
+
+    lat = []
+    errors = 0
+    st = time.perf_counter()
+    for cid, cp in enumerate(comics, 1):
+        reslist = [(0, 0, os.path.join(workdir, 'p%d-native.jpg' % cid))]
+        reslist.extend((rx, ry, os.path.join(workdir, '%d-%dx%d.jpg' % (cid, rx, ry))) for rx, ry in LADDER)
+        bst = time.perf_counter()
+        edict = extract_thumb((cp, cid, reslist, 0))
+        lat.append(time.perf_counter() - bst)
+        if edict is None or edict.get('error'):
+            errors += 1
+
+    return lat, errors, time.perf_counter() - st
+
+
+def run_extract(comics, workdir):
+    from gazee.archive import extract_archive
+
+    lat = []
+    errors = 0
+    st = time.perf_counter()
+    for cid, cp in enumerate(comics, 1):
+        outdir = os.path.join(workdir, str(cid))
+        os.makedirs(outdir)
+        bst = time.perf_counter()
+        ifiles = extract_archive(cp, outdir, 'p%d-' % cid)
+        lat.append(time.perf_counter() - bst)
+        if not isinstance(ifiles, list) or len(ifiles) == 0:
+            errors += 1
+        shutil.rmtree(outdir)
+
+    return lat, errors, time.perf_counter() - st
+
+
+def run_job(comicdir, workdir, engine, workers, sampler):
+    """ Sets up a config and db under workdir pointing at comicdir, scans it
+    (untimed) and then times do_thumb_job().
+    """
+    datadir = os.path.join(workdir, 'data')
+    tempdir = os.path.join(workdir, 'temp')
+    os.makedirs(datadir)
+    os.makedirs(tempdir)
+    with open(os.path.join(datadir, 'app.ini'), 'w') as fd:
+        fd.write('[GLOBAL]\ncomic_path = %s\ntemp_dir = %s\n' % (comicdir, tempdir))
+
+    import gazee.config
+    import gazee.comic_db
+    gazee.config.gcfg(datadir)
+    gazee.config.THUMB_ENGINE = engine
+    gazee.config.THUMB_WORKERS = workers
+    gazee.config.READER_PAUSE = 0
+    gazee.config.SCAN_MAX_MBPS = 0
+
+    db = gazee.comic_db.comic_db()
+    db.scan_directory_tree(comicdir, 0)
+
+    lat = []
+    errors = []
+    store = db.store_thumb_results
+
+    def store_and_time(results, errs=()):
+        lat.extend(edict.pop('bench_secs', 0) for edict, series, issue in results)
+        lat.extend(edict.pop('bench_secs', 0) for edict in errs)
+        errors.extend(errs)
+        return store(results, errs)
+
+    db.store_thumb_results = store_and_time
+    gazee.comic_db.extract_thumb = timed_extract_thumb
+    sampler.pids = lambda: pool_pids(db._thumb_pool)
+
+    st = time.perf_counter()
+    try:
+        db.do_thumb_job()
+    finally:
+        elapsed = time.perf_counter() - st
+        db.close_thumb_pool()
+
+    return lat, len(errors), elapsed
+
+
+def run_mode(mode, comicdir, engine, workers):
+    """ Runs in its own interpreter (see main()), prints a JSON result. """
+    comics = list_comics(comicdir)
+    workdir = tempfile.mkdtemp(prefix='gazee-bench-%s-' % mode)
+    sampler = PeakRss()
+    sampler.start()
+
+    try:
+        if mode == 'thumb':
+            lat, errors, elapsed = run_thumb(comics, workdir)
+        elif mode == 'extract':
+            lat, errors, elapsed = run_extract(comics, workdir)
+        else:
+            lat, errors, elapsed = run_job(comicdir, workdir, engine, workers, sampler)
+    finally:
+        peak = sampler.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps({'books': len(lat), 'errors': errors, 'elapsed': elapsed,
+                      'lat': lat, 'peak_rss_kb': peak}))
+
+
+def percentile(vals, pct):
+    if len(vals) == 0:
+        return 0.0
+    vals = sorted(vals)
+    return vals[max(0, int(math.ceil(pct / 100.0 * len(vals))) - 1)]
+
+
+def report(mode, res):
+    books = res['books']
+    rate = books / res['elapsed'] if res['elapsed'] > 0 else 0.0
+    print("%-8s %5d books in %7.2f s  %7.1f books/sec  p50: %7.1f ms  p95: %7.1f ms  peak RSS: %7.1f MiB%s" %
+          (mode, books, res['elapsed'], rate,
+           percentile(res['lat'], 50) * 1000, percentile(res['lat'], 95) * 1000,
+           res['peak_rss_kb'] / 1024.0, ('  %d errors' % res['errors']) if res['errors'] else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('-n', dest='num', type=int, default=100, help='books to generate')
+    parser.add_argument('-p', dest='pages', type=int, default=24, help='average pages per generated book')
+    parser.add_argument('-s', dest='seed', type=int, default=1, help='generator seed')
+    parser.add_argument('-e', dest='engine', choices=['process', 'thread'], default='process',
+                        help='thumb_engine for the job mode')
+    parser.add_argument('-w', dest='workers', type=int, default=0,
+                        help='thumb_workers for the job mode (0 for one per cpu)')
+    parser.add_argument('-m', dest='modes', default=','.join(MODES))
+    parser.add_argument('--run', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('comicdir', nargs='?')
+    args = parser.parse_args()
+
+    if args.run:
+        run_mode(args.run, args.comicdir, args.engine, args.workers)
+        return
+
+    modes = [m.strip() for m in args.modes.split(',') if m.strip()]
+    for mode in modes:
+        if mode not in MODES:
+            parser.error("unknown mode: %s" % mode)
+
+    tmpdir = tempfile.mkdtemp(prefix='gazee-corpus-')
+
+    try:
+        comicdir = args.comicdir
+        if comicdir is None:
+            comicdir = os.path.join(tmpdir, 'comics')
+            st = time.perf_counter()
+            manifest = make_corpus(comicdir, args.num, args.pages, args.seed)
+            print("Generated %d books (seed %d%s) in %.1f s" %
+                  (len(manifest['books']), args.seed, ', with CBRs' if manifest['rar'] else '',
+                   time.perf_counter() - st))
+
+        for mode in modes:
+            out = subprocess.check_output([sys.executable, __file__, '--run', mode,
+                                           '-e', args.engine, '-w', str(args.workers), comicdir])
+            report(mode, json.loads(out.decode().strip().split('\n')[-1]))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Compares the in-process Pillow border effect (gazee.imageborder) against the
+imgproc/imageborder ImageMagick script it replaced, on the same cover.
+
+    python3 bench/bench_imageborder.py [-n 20] [-T 300x400] [cover.jpg]
+
+Without a cover, a synthetic 1988x3056 one is generated.  The script half is
+skipped if ImageMagick's convert isn't in the PATH.
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
+
+from PIL import Image, ImageChops, ImageDraw, ImageStat
+from gazee.imageborder import image_border
+
+SCRIPT = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', 'gazee', 'imgproc', 'imageborder'))
+
+
+def make_cover(path, size=(1988, 3056)):
+    im = Image.new('RGB', size, (30, 60, 120))
+    dr = ImageDraw.Draw(im)
+    for i in range(0, size[1], 97):
+        x0, x1 = sorted((i % size[0], (i * 7) % size[0]))
+        dr.rectangle((x0, i, x1, i + 180), fill=((i * 3) % 255, (i * 5) % 255, 90))
+    im.save(path, quality=92)
+
+
+def run_pillow(cover, tw, th, opath, num):
+    times = []
+    for i in range(num):
+        st = time.perf_counter()
+        im = Image.open(cover)
+        im.draft('RGB', (tw, th))
+        image_border(im, tw, th).save(opath, quality=85)
+        times.append(time.perf_counter() - st)
+    return times
+
+
+def run_script(cover, tw, th, opath, num, workdir):
+    times = []
+    for i in range(num):
+        st = time.perf_counter()
+        subprocess.check_call(['/bin/bash', SCRIPT, '-T', '%dx%d' % (tw, th), cover, opath],
+                              cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - st)
+    return times
+
+
+def report(name, times):
+    times = sorted(times)
+    mean = sum(times) / len(times)
+    print("%-8s  mean: %7.2f ms  min: %7.2f ms  max: %7.2f ms  (%.1f thumbs/sec)" %
+          (name, mean * 1000, times[0] * 1000, times[-1] * 1000, 1.0 / mean))
+    return mean
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('-n', dest='num', type=int, default=20)
+    parser.add_argument('-T', dest='size', default='300x400')
+    parser.add_argument('cover', nargs='?')
+    args = parser.parse_args()
+
+    tw, th = [int(v, 10) for v in args.size.split('x')]
+    tmpdir = tempfile.mkdtemp(prefix='gazee-bench-')
+
+    try:
+        cover = args.cover
+        if cover is None:
+            cover = os.path.join(tmpdir, 'cover.jpg')
+            make_cover(cover)
+
+        popath = os.path.join(tmpdir, 'pillow.jpg')
+        pmean = report('pillow', run_pillow(cover, tw, th, popath, args.num))
+
+        if shutil.which('convert') is None:
+            print("convert isn't in the PATH, skipping the ImageMagick script.")
+            return
+
+        sopath = os.path.join(tmpdir, 'script.jpg')
+        smean = report('script', run_script(cover, tw, th, sopath, args.num, tmpdir))
+        print("speedup: %.1fx" % (smean / pmean))
+
+        pim = Image.open(popath).convert('RGB')
+        sim = Image.open(sopath).convert('RGB')
+        print("sizes: pillow %dx%d  script %dx%d" % (pim.width, pim.height, sim.width, sim.height))
+        if pim.size != sim.size:
+            sim = sim.resize(pim.size, Image.LANCZOS)
+        diff = ImageStat.Stat(ImageChops.difference(pim, sim)).mean
+        print("mean abs pixel difference (R, G, B): %.2f %.2f %.2f" % tuple(diff))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Compares what the scan's picture of the db (the directory and filename
+lookups, and dir_info) costs in memory and lookup time, kept as dicts the
+way it used to be versus the PathIndex and FileIndex arrays.
+
+    python3 bench/bench_pathindex.py [-n 100000,500000,1000000] [-f 20]
+
+n is the number of comics, f how many there are per directory.  Every size
+is run in its own interpreter, and memory is what tracemalloc sees
+allocated once the structure's built (the rows it's built from are gone by
+then, as they are in the scan), plus the peak while building it.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+import subprocess
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
+
+WORDS = ['Night', 'Patrol', 'Long', 'Walk', 'Star', 'Harbor', 'Iron', 'Dawn', 'Pocket',
+         'Universe', 'Heavy', 'Metal', 'Kid', 'Glass', 'Houses', 'Orchard', 'Rust', 'Orbit']
+
+
+def dir_rows(num, perdir):
+    """ Yields (dirid, parentid, path) like all_directories would. """
+    for did in range(1, num // perdir + 2):
+        yield (did, did // 50, '/srv/comics/Publisher %d/%s %s %d' %
+               (did % 50, WORDS[did % len(WORDS)], WORDS[(did * 7) % len(WORDS)], did))
+
+
+def comic_rows(num, perdir):
+    """ Yields (dirid, comicid, filename) in dirid order, like the scan's
+    query.
+    """
+    for cid in range(1, num + 1):
+        did = (cid - 1) // perdir + 1
+        yield (did, cid, '%s %s %03d (%d).cbz' %
+               (WORDS[did % len(WORDS)], WORDS[(did * 7) % len(WORDS)], cid % perdir + 1,
+                1980 + cid % 40))
+
+
+def build_dicts(num, perdir):
+    """ dir_info used to have each directory's path in it as well. """
+    dir_cache = {}
+    dir_info = {}
+    for did, parentid, dp in dir_rows(num, perdir):
+        dir_info[did] = (dp, parentid, 1500000000.0 + did)
+        if dp not in dir_cache:
+            dir_cache[dp] = did
+    fn_cache = {}
+    for did, cid, fn in comic_rows(num, perdir):
+        if did not in fn_cache:
+            fn_cache[did] = {fn: cid}
+        else:
+            fn_cache[did][fn] = cid
+    return dir_cache, dir_info, fn_cache
+
+
+def build_index(num, perdir):
+    """ Paths are only in the PathIndex, dir_info is parentid and mtime. """
+    from gazee.pathindex import PathIndex, FileIndex
+    dir_cache = PathIndex((dp, did) for did, parentid, dp in dir_rows(num, perdir))
+    dir_info = {}
+    for did, parentid, dp in dir_rows(num, perdir):
+        dir_info[did] = (parentid, 1500000000.0 + did)
+    fn_cache = FileIndex(comic_rows(num, perdir))
+    return dir_cache, dir_info, fn_cache
+
+
+def lookup_dicts(dir_cache, dir_info, fn_cache, dirs, dids, files):
+    for dp in dirs:
+        dir_cache.get(dp)
+    for did in dids:
+        dir_info[did][0]
+    for did, fn in files:
+        fn in fn_cache.get(did, {})
+
+
+def lookup_index(dir_cache, dir_info, fn_cache, dirs, dids, files):
+    for dp in dirs:
+        dir_cache.get(dp)
+    for did in dids:
+        dir_cache.path(did)
+    for did, fn in files:
+        fn in fn_cache.in_dir(did)
+
+
+def run_size(kind, num, perdir):
+    """ Runs in its own interpreter (see main()), prints a JSON result. """
+    build, lookup = {'dict': (build_dicts, lookup_dicts),
+                     'index': (build_index, lookup_index)}[kind]
+
+    # Made before tracing starts, they're not part of what's measured.
+    rng = random.Random(1)
+    dirs = [dp for did, parentid, dp in dir_rows(num, perdir)]
+    dirs = [rng.choice(dirs) for i in range(100000)]
+    dids = [rng.randint(1, num // perdir + 1) for i in range(100000)]
+    files = [(did, fn) for did, cid, fn in comic_rows(num, perdir)]
+    files = [rng.choice(files) for i in range(100000)]
+    if kind == 'index':
+        import gazee.pathindex
+
+    # Timed without tracemalloc, it slows allocations right down.
+    st = time.perf_counter()
+    caches = build(num, perdir)
+    built = time.perf_counter() - st
+    del caches
+
+    tracemalloc.start()
+    caches = build(num, perdir)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    st = time.perf_counter()
+    lookup(*caches, dirs, dids, files)
+    looked = time.perf_counter() - st
+
+    print(json.dumps({'size': size, 'peak': peak, 'build': built,
+                      'lookup_us': looked / (len(dirs) + len(dids) + len(files)) * 1e6}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('-n', dest='sizes', default='100000,500000,1000000')
+    parser.add_argument('-f', dest='perdir', type=int, default=20)
+    parser.add_argument('--run', choices=['dict', 'index'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    sizes = [int(n, 10) for n in args.sizes.split(',')]
+    if args.run:
+        run_size(args.run, sizes[0], args.perdir)
+        return
+
+    print("%d comics per directory" % args.perdir)
+    for num in sizes:
+        res = {}
+        for kind in ('dict', 'index'):
+            out = subprocess.check_output([sys.executable, __file__, '--run', kind,
+                                           '-n', str(num), '-f', str(args.perdir)])
+            res[kind] = json.loads(out.decode().strip().split('\n')[-1])
+            r = res[kind]
+            print("%8d %-6s %8.1f MiB (peak %8.1f MiB)  built in %6.2f s  %5.2f us/lookup" %
+                  (num, kind, r['size'] / 1048576.0, r['peak'] / 1048576.0, r['build'],
+                   r['lookup_us']))
+        print("%8d index is %.1fx smaller" % (num, res['dict']['size'] / max(1, res['index']['size'])))
+
+
+if __name__ == '__main__':
+    main()
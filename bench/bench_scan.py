@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Times comic_db.scan_directory_tree() on a simulated slow filesystem (every
+stat and directory listing made to wait, like a round trip to an NFS or SMB
+server would), with different numbers of scan_threads.
+
+    python3 bench/bench_scan.py [-d 200] [-f 20] [-l 2] [-t 1,4,8,16] [comic dir]
+
+Without a comic dir, a tree of d directories with f (tiny) comics apiece is
+made.  For each thread count it times the first scan into an empty db, a
+rescan with nothing changed, and one with a tenth of the directories
+touched.  The latency (-l, in ms) only applies to the scan's stats and
+listings, not to fingerprinting new comics.
+"""
+
+import os
+import io
+import sys
+import time
+import shutil
+import zipfile
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+class SlowEntry(object):
+    def __init__(self, ent, latency):
+        self._ent = ent
+        self._latency = latency
+
+    def __getattr__(self, name):
+        return getattr(self._ent, name)
+
+    def stat(self, *args, **kwargs):
+        time.sleep(self._latency)
+        return self._ent.stat(*args, **kwargs)
+
+
+class SlowScandir(object):
+    def __init__(self, it, latency):
+        self._it = it
+        self._latency = latency
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._it.close()
+
+    def __iter__(self):
+        for ent in self._it:
+            yield SlowEntry(ent, self._latency)
+
+
+class SlowOs(object):
+    """ Stands in for the os module, with stat() and scandir() (and the
+    DirEntry stats) taking latency seconds longer.
+    """
+    def __init__(self, latency):
+        self._latency = latency
+
+    def __getattr__(self, name):
+        return getattr(os, name)
+
+    def stat(self, *args, **kwargs):
+        time.sleep(self._latency)
+        return os.stat(*args, **kwargs)
+
+    def scandir(self, *args, **kwargs):
+        time.sleep(self._latency)
+        return SlowScandir(os.scandir(*args, **kwargs), self._latency)
+
+
+def make_tree(comicdir, ndirs, nfiles):
+    bio = io.BytesIO()
+    with zipfile.ZipFile(bio, 'w') as zf:
+        zf.writestr('001.jpg', b'\xff\xd8\xff\xd9')
+    data = bio.getvalue()
+
+    for d in range(ndirs):
+        dp = os.path.join(comicdir, 'Publisher %d' % (d % 10), 'Series %d' % d)
+        os.makedirs(dp)
+        for f in range(nfiles):
+            with open(os.path.join(dp, 'Series %d %03d (2017).cbz' % (d, f)), 'wb') as fd:
+                fd.write(data)
+
+    # Old enough that the scan keeps the mtimes (it skips ones from the
+    # last couple of seconds).
+    for dirpath, dirnames, filenames in os.walk(comicdir):
+        os.utime(dirpath, (time.time() - 60, time.time() - 60))
+
+
+def run_threads(comicdir, threads, latency):
+    """ Runs in its own interpreter (see main()), prints the timings. """
+    workdir = tempfile.mkdtemp(prefix='gazee-bench-scan-')
+    datadir = os.path.join(workdir, 'data')
+    tempdir = os.path.join(workdir, 'temp')
+    os.makedirs(datadir)
+    os.makedirs(tempdir)
+    with open(os.path.join(datadir, 'app.ini'), 'w') as fd:
+        fd.write('[GLOBAL]\ncomic_path = %s\ntemp_dir = %s\n' % (comicdir, tempdir))
+
+    import logging
+    logging.disable(logging.INFO)
+    import gazee.config
+    import gazee.comic_db
+    gazee.config.gcfg(datadir)
+    gazee.config.SCAN_THREADS = threads
+    gazee.config.READER_PAUSE = 0
+    gazee.config.SCAN_MAX_MBPS = 0
+    gazee.comic_db.os = SlowOs(latency)
+
+    try:
+        db = gazee.comic_db.comic_db()
+
+        st = time.perf_counter()
+        db.scan_directory_tree(comicdir, 0)
+        first = time.perf_counter() - st
+
+        st = time.perf_counter()
+        db.scan_directory_tree(comicdir, 0)
+        nochange = time.perf_counter() - st
+
+        dirs = sorted(dp for dp in map(db.dir_cache.path, db.dir_info) if dp != os.path.normpath(comicdir))
+        for p in dirs[::10]:
+            os.utime(p, (time.time() - 30, time.time() - 30))
+        st = time.perf_counter()
+        db.scan_directory_tree(comicdir, 0)
+        touched = time.perf_counter() - st
+
+        ncomics = db.get_all_comics_count()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("%d %f %f %f" % (ncomics, first, nochange, touched))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('-d', dest='dirs', type=int, default=200)
+    parser.add_argument('-f', dest='files', type=int, default=20)
+    parser.add_argument('-l', dest='latency', type=float, default=2.0, help='ms per stat/listing')
+    parser.add_argument('-t', dest='threads', default='1,4,8,16')
+    parser.add_argument('--run', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('comicdir', nargs='?')
+    args = parser.parse_args()
+
+    if args.run:
+        run_threads(args.comicdir, args.run, args.latency / 1000.0)
+        return
+
+    tmpdir = tempfile.mkdtemp(prefix='gazee-bench-')
+
+    try:
+        comicdir = args.comicdir
+        if comicdir is None:
+            comicdir = os.path.join(tmpdir, 'comics')
+            make_tree(comicdir, args.dirs, args.files)
+
+        print("%.1f ms per stat/listing" % args.latency)
+        base = None
+        for threads in [int(t, 10) for t in args.threads.split(',')]:
+            out = subprocess.check_output([sys.executable, __file__, '--run', str(threads),
+                                           '-l', str(args.latency), comicdir])
+            ncomics, first, nochange, touched = out.decode().strip().split('\n')[-1].split()
+            first, nochange, touched = float(first), float(nochange), float(touched)
+            if base is None:
+                base = (first, nochange, touched)
+            print("%3d threads  %s comics  first scan: %7.2f s (%4.1fx)  no changes: %6.2f s (%4.1fx)  "
+                  "10%% touched: %6.2f s (%4.1fx)" %
+                  (threads, ncomics, first, base[0] / first, nochange, base[1] / nochange,
+                   touched, base[2] / touched))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Compares the two thumb_engine settings, a process Pool and a ThreadPool, at
+making thumbnails (archive.extract_thumb) for the same set of comics.
+
+    python3 bench/bench_thumb_engine.py [-n 64] [-p 24] [-s 1] [-w 4] [comic dir]
+
+Without a comic dir, a library of n books is generated with gen_corpus.py
+(the same one bench_archive.py uses, for the same -n, -p and -s).  If rar is
+in the PATH, its CBZs and CBRs are timed separately.  Each engine gets run
+in its own interpreter, so the peak RSS (of the whole thing, workers
+included) is its own.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
+
+from gen_corpus import make_corpus
+from benchutil import COMIC_EXTS, list_comics, pool_pids, PeakRss
+
+
+def run_engine(engine, libdir, workers, exts=COMIC_EXTS):
+    """ Runs in its own interpreter (see main()), prints a JSON result. """
+    from multiprocessing import Pool
+    from multiprocessing.pool import ThreadPool
+    from gazee.archive import extract_thumb
+
+    comics = list_comics(libdir, exts)
+    outdir = tempfile.mkdtemp(prefix='gazee-thumbs-')
+    jobs = []
+    for cid, cp in enumerate(comics, 1):
+        reslist = [(0, 0, os.path.join(outdir, 'p%d-native.jpg' % cid))]
+        for rx, ry in [(300, 400), (600, 800), (150, 200), (75, 100)]:
+            reslist.append((rx, ry, os.path.join(outdir, '%d-%dx%d.jpg' % (cid, rx, ry))))
+        jobs.append((cp, cid, reslist, 0))
+
+    try:
+        st = time.perf_counter()
+        pool = ThreadPool(processes=workers) if engine == 'thread' else Pool(processes=workers)
+        sampler = PeakRss(lambda: pool_pids(pool))
+        sampler.start()
+        started = time.perf_counter() - st
+
+        errors = 0
+        for edict in pool.imap_unordered(extract_thumb, jobs):
+            if edict is None or edict.get('error'):
+                errors += 1
+        elapsed = time.perf_counter() - st
+
+        peak = sampler.stop()
+        pool.terminate()
+        pool.join()
+    finally:
+        shutil.rmtree(outdir, ignore_errors=True)
+
+    print(json.dumps({'books': len(jobs), 'errors': errors, 'elapsed': elapsed,
+                      'startup': started, 'peak_rss_kb': peak}))
+
+
+def bench(engine, libdir, workers, ext=None):
+    cmd = [sys.executable, __file__, '--run', engine, '-w', str(workers)]
+    if ext is not None:
+        cmd.extend(['-x', ext])
+    out = subprocess.check_output(cmd + [libdir])
+    return json.loads(out.decode().strip().split('\n')[-1])
+
+
+def report(label, engine, res):
+    print("%-4s %-8s  %4d books in %6.2f s  (%6.1f books/sec, pool startup %5.1f ms)  peak RSS: %7.1f MiB%s" %
+          (label, engine, res['books'], res['elapsed'], res['books'] / res['elapsed'],
+           res['startup'] * 1000, res['peak_rss_kb'] / 1024.0,
+           ('  %d errors' % res['errors']) if res['errors'] else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('-n', dest='num', type=int, default=64, help='books to generate')
+    parser.add_argument('-p', dest='pages', type=int, default=24, help='average pages per generated book')
+    parser.add_argument('-s', dest='seed', type=int, default=1, help='generator seed')
+    parser.add_argument('-w', dest='workers', type=int, default=os.cpu_count() or 4)
+    parser.add_argument('-x', dest='ext', help=argparse.SUPPRESS)
+    parser.add_argument('--run', choices=['process', 'thread'], help=argparse.SUPPRESS)
+    parser.add_argument('comicdir', nargs='?')
+    args = parser.parse_args()
+
+    if args.run:
+        exts = ('.' + args.ext, ) if args.ext else COMIC_EXTS
+        run_engine(args.run, args.comicdir, args.workers, exts)
+        return
+
+    tmpdir = tempfile.mkdtemp(prefix='gazee-bench-')
+
+    try:
+        libs = []
+        if args.comicdir:
+            libs.append(('lib', args.comicdir, None))
+        else:
+            libdir = os.path.join(tmpdir, 'comics')
+            manifest = make_corpus(libdir, args.num, args.pages, args.seed)
+            libs.append(('cbz', libdir, 'cbz'))
+            if manifest['rar']:
+                libs.append(('cbr', libdir, 'cbr'))
+            else:
+                print("rar isn't in the PATH, skipping the CBRs.")
+
+        print("%d workers" % args.workers)
+        for label, libdir, ext in libs:
+            results = {}
+            for engine in ('process', 'thread'):
+                results[engine] = bench(engine, libdir, args.workers, ext)
+                report(label, engine, results[engine])
+            ratio = results['process']['elapsed'] / results['thread']['elapsed']
+            mem = results['process']['peak_rss_kb'] / max(1, results['thread']['peak_rss_kb'])
+            print("%-4s threads: %.2fx the throughput, %.2fx less memory" % (label, ratio, mem))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+What the benchmarks have in common: finding the comics in a library, and
+keeping track of peak RSS (of the benchmark and its pool's workers).
+"""
+
+import os
+import threading
+
+COMIC_EXTS = ('.cbz', '.cbr', '.zip', '.rar')
+
+
+def list_comics(libdir, exts=COMIC_EXTS):
+    rv = []
+    for dp, dns, fns in os.walk(libdir):
+        for fn in fns:
+            if fn.lower().endswith(exts):
+                rv.append(os.path.join(dp, fn))
+    return sorted(rv)
+
+
+def rss_kb(pid):
+    try:
+        with open('/proc/%d/status' % pid) as fd:
+            for line in fd:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def pool_pids(pool):
+    """ The worker pids of a multiprocessing Pool, none for a ThreadPool. """
+    if pool is None:
+        return []
+    return [w.pid for w in getattr(pool, '_pool', []) if getattr(w, 'pid', None)]
+
+
+class PeakRss(threading.Thread):
+    """ Samples the combined RSS of this process and whatever pids() returns
+    (ie: pool workers) until stop() is called.
+    """
+    def __init__(self, pids=None):
+        super().__init__(daemon=True)
+        self.pids = pids
+        self.peak = 0
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(0.02):
+            pids = [os.getpid()]
+            if self.pids is not None:
+                pids.extend(self.pids())
+            self.peak = max(self.peak, sum(rss_kb(pid) for pid in pids))
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        return self.peak
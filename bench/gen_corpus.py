@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Generates a reproducible library of synthetic comics to benchmark against.
+
+    python3 bench/gen_corpus.py [-n 200] [-p 24] [-s 1] [--no-rar] outdir
+
+The same seed always gives the same library.  Books are spread over
+Publisher/Series/ folders (some a level deeper), and between them cover:
+stored and deflated members, JPEG, PNG and GIF pages, landscape covers,
+huge pages, pages in folders inside of the archive and ComicInfo.xml.
+If rar is in the PATH, a share of the books are written as CBRs instead,
+solid and not.  outdir/manifest.json lists every book and what's in it.
+"""
+
+import os
+import io
+import json
+import random
+import shutil
+import zipfile
+import argparse
+import tempfile
+import subprocess
+
+from PIL import Image, ImageDraw
+
+PAGE_SIZE = (1400, 2100)
+HUGE_SIZE = (6000, 9000)
+PUBLISHERS = ['Acme Comics', 'Blue Moon Press', 'Cobalt', 'Dynamo Books']
+SERIES = ['Night Patrol', 'The Long Walk', 'Star Harbor', 'Iron Dawn', 'Pocket Universe',
+          'Heavy Metal Kid', 'Glass Houses', 'The Orchard', 'Rust', 'Low Orbit']
+
+COMICINFO = '''<?xml version="1.0" encoding="utf-8"?>
+<ComicInfo xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+  <Series>%(series)s</Series>
+  <Number>%(number)d</Number>
+  <Volume>%(volume)d</Volume>
+  <Summary>Synthetic issue %(number)d of %(series)s.</Summary>
+  <Publisher>%(publisher)s</Publisher>
+  <PageCount>%(pages)d</PageCount>
+</ComicInfo>
+'''
+
+
+class PageMaker(object):
+    """ Encodes page images, keeping a handful of variants of every (format,
+    size) so a big library doesn't spend all its time in the encoder.
+    """
+    VARIANTS = 4
+
+    def __init__(self, seed):
+        self._seed = seed
+        self._cache = {}
+
+    def page(self, fmt, size, n):
+        key = (fmt, size, n % self.VARIANTS)
+        data = self._cache.get(key)
+        if data is None:
+            data = self._render(fmt, size, key[2])
+            self._cache[key] = data
+        return data
+
+    def _render(self, fmt, size, variant):
+        rng = random.Random('%s-%s-%dx%d-%d' % (self._seed, fmt, size[0], size[1], variant))
+        im = Image.new('RGB', size, (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        dr = ImageDraw.Draw(im)
+        for i in range(40):
+            x0, x1 = sorted((rng.randrange(size[0]), rng.randrange(size[0])))
+            y0, y1 = sorted((rng.randrange(size[1]), rng.randrange(size[1])))
+            dr.rectangle((x0, y0, x1, y1), fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+            dr.line((x0, y1, x1, y0), fill=(0, 0, 0), width=max(1, size[0] // 200))
+
+        bio = io.BytesIO()
+        if fmt == 'jpg':
+            im.save(bio, format='JPEG', quality=88)
+        elif fmt == 'png':
+            im.save(bio, format='PNG')
+        else:
+            im.convert('P', palette=Image.ADAPTIVE).save(bio, format='GIF')
+        return bio.getvalue()
+
+
+def plan_book(rng, idx, pages, use_rar):
+    """ What goes into book idx: where it lives and which of the awkward
+    cases it covers.
+    """
+    publisher = PUBLISHERS[idx % len(PUBLISHERS)]
+    series = SERIES[(idx // len(PUBLISHERS)) % len(SERIES)]
+    number = idx // (len(PUBLISHERS) * len(SERIES)) + 1
+    year = 1990 + rng.randrange(30)
+
+    book = {'publisher': publisher,
+            'series': series,
+            'number': number,
+            'volume': 1 + (idx % 3),
+            'pages': max(1, pages + rng.randrange(-pages // 4, pages // 4 + 1)),
+            'format': rng.choice(['jpg'] * 6 + ['png'] * 2 + ['gif']),
+            'deflated': rng.random() < 0.5,
+            'landscape_cover': rng.random() < 0.1,
+            'huge_page': rng.random() < 0.05,
+            'nested_members': rng.random() < 0.2,
+            'comicinfo': rng.random() < 0.4,
+            'archive': 'zip'}
+
+    if use_rar and rng.random() < 0.3:
+        book['archive'] = 'rar'
+        book['solid'] = rng.random() < 0.5
+
+    reldir = os.path.join(publisher, series)
+    if rng.random() < 0.15:
+        reldir = os.path.join(reldir, 'Volume %d' % book['volume'])
+    ext = '.cbr' if book['archive'] == 'rar' else '.cbz'
+    book['path'] = os.path.join(reldir, '%s %03d (%d)%s' % (series, number, year, ext))
+
+    return book
+
+
+def book_members(book, maker):
+    """ Yields (member name, data) for everything that goes in the book. """
+    fmt = book['format']
+    pfx = 'pages/chapter %d/' % book['number'] if book['nested_members'] else ''
+
+    for p in range(book['pages']):
+        size = PAGE_SIZE
+        if p == 0 and book['landscape_cover']:
+            size = (PAGE_SIZE[1], PAGE_SIZE[0])
+        elif p == book['pages'] // 2 and book['huge_page']:
+            size = HUGE_SIZE
+        yield ('%s%03d.%s' % (pfx, p + 1, fmt), maker.page(fmt, size, book['number'] + p))
+
+    if book['comicinfo']:
+        yield ('ComicInfo.xml', (COMICINFO % book).encode('utf-8'))
+
+
+def write_zip(path, book, maker):
+    ctype = zipfile.ZIP_DEFLATED if book['deflated'] else zipfile.ZIP_STORED
+    with zipfile.ZipFile(path, 'w', ctype) as zf:
+        for name, data in book_members(book, maker):
+            # A fixed date, so the same seed makes byte for byte the same file.
+            zi = zipfile.ZipInfo(name, date_time=(2017, 1, 1, 0, 0, 0))
+            zi.compress_type = ctype
+            zf.writestr(zi, data)
+
+
+def write_rar(path, book, maker):
+    stage = tempfile.mkdtemp(prefix='gazee-rar-')
+    try:
+        names = []
+        for name, data in book_members(book, maker):
+            fn = os.path.join(stage, name)
+            os.makedirs(os.path.dirname(fn), exist_ok=True)
+            with open(fn, 'wb') as fd:
+                fd.write(data)
+            names.append(name)
+
+        cmd = ['rar', 'a', '-idq', '-ep0', '-m3' if book['deflated'] else '-m0']
+        if book.get('solid'):
+            cmd.append('-s')
+        subprocess.check_call(cmd + [os.path.realpath(path)] + names, cwd=stage,
+                              stdout=subprocess.DEVNULL)
+    finally:
+        shutil.rmtree(stage, ignore_errors=True)
+
+
+def make_corpus(outdir, num, pages=24, seed=1, use_rar=None):
+    """ Writes num books into outdir, returns the manifest (also saved as
+    outdir/manifest.json).  use_rar=None means "if rar is installed".
+    """
+    if use_rar is None:
+        use_rar = shutil.which('rar') is not None
+
+    rng = random.Random(seed)
+    maker = PageMaker(seed)
+    books = []
+
+    for idx in range(num):
+        book = plan_book(rng, idx, pages, use_rar)
+        path = os.path.join(outdir, book['path'])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if book['archive'] == 'rar':
+            write_rar(path, book, maker)
+        else:
+            write_zip(path, book, maker)
+        book['size'] = os.path.getsize(path)
+        books.append(book)
+
+    manifest = {'seed': seed, 'pages': pages, 'rar': use_rar, 'books': books}
+    with open(os.path.join(outdir, 'manifest.json'), 'w') as fd:
+        json.dump(manifest, fd, indent=1)
+
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('-n', dest='num', type=int, default=200, help='number of books')
+    parser.add_argument('-p', dest='pages', type=int, default=24, help='average pages per book')
+    parser.add_argument('-s', dest='seed', type=int, default=1)
+    parser.add_argument('--no-rar', dest='rar', action='store_false', default=None,
+                        help="only write CBZs, even if rar is installed")
+    parser.add_argument('outdir')
+    args = parser.parse_args()
+
+    if args.rar is None and shutil.which('rar') is None:
+        print("rar isn't in the PATH, only writing CBZs.")
+
+    manifest = make_corpus(args.outdir, args.num, args.pages, args.seed, args.rar)
+    books = manifest['books']
+    print("%d books, %.1f MiB" % (len(books), sum(b['size'] for b in books) / 1048576.0))
+    for key in ['deflated', 'landscape_cover', 'huge_page', 'nested_members', 'comicinfo']:
+        print("  %-16s %d" % (key, sum(1 for b in books if b[key])))
+    for fmt in ['jpg', 'png', 'gif']:
+        print("  %-16s %d" % (fmt + ' pages', sum(1 for b in books if b['format'] == fmt)))
+    print("  %-16s %d (%d solid)" % ('cbr', sum(1 for b in books if b['archive'] == 'rar'),
+                                     sum(1 for b in books if b.get('solid'))))
+
+
+if __name__ == '__main__':
+    main()
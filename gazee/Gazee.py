@@ -178,6 +178,9 @@ def main():
             'tools.basic_auth.encrypt': gazee.gazee_settings_db.hash_pass,
             'request.show_tracebacks': False
         },
+        '/read_page': {
+            'tools.gzip.on': False
+        },
         '/static': {
             'tools.staticdir.on': True,
             'tools.staticdir.dir': pubdir
@@ -15,9 +15,16 @@ import zipfile
 import rarfile
 import traceback
 from io import BytesIO
+from xml.etree import ElementTree
 from PIL import Image
+from gazee.imageborder import image_border
 import subprocess
 import math
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 
 log = logging.getLogger(__name__)
 
@@ -43,6 +50,228 @@ def identify_arch(cp):
     return None
 
 
+def open_archive(cp):
+    """ Returns an open zipfile/rarfile archive object for cp, or None if
+    the file isn't a recognized archive.  The caller is responsible for
+    closing it.
+    """
+    atype = identify_arch(cp)
+
+    if atype == 1:
+        return zipfile.ZipFile(cp)
+    elif atype == 2:
+        return rarfile.RarFile(cp)
+
+    return None
+
+
+def archive_fingerprint(cp, size=None):
+    """ A cheap content fingerprint for the archive at cp that doesn't change
+    when it's moved or renamed: its size, plus a SHA-1 of the ZIP central
+    directory, or of the name/size/CRC of every member of a RAR.  Only the
+    headers get read, never the pages.
+    - Returns None if cp isn't a recognized archive.
+    """
+    return archive_fingerprint_read(cp, size)[0]
+
+
+def archive_fingerprint_read(cp, size=None):
+    """ archive_fingerprint(), plus roughly how many bytes of cp it read:
+    (fingerprint, nbytes).
+    """
+    if size is None:
+        size = os.path.getsize(cp)
+
+    atype = identify_arch(cp)
+    h = hashlib.sha1()
+    nread = 4
+
+    if atype == 1:
+        with open(cp, 'rb') as fd:
+            # Most ZIPs have no comment, so the end of central directory
+            # record is the last thing in the file and that's all that has
+            # to be read to find the central directory.
+            taillen = min(size, zipfile.sizeEndCentDir)
+            fd.seek(size - taillen)
+            tail = fd.read(taillen)
+            nread += len(tail)
+            if not tail.startswith(zipfile.stringEndArchive):
+                taillen = min(size, 65536 + zipfile.sizeEndCentDir)
+                fd.seek(size - taillen)
+                tail = fd.read(taillen)
+                nread += len(tail)
+
+            eocd = tail.rfind(zipfile.stringEndArchive)
+            cdbytes = None
+            if eocd >= 0 and eocd + zipfile.sizeEndCentDir <= len(tail):
+                cdsize, cdoff = struct.unpack('<II', tail[eocd + 12:eocd + 20])
+                if cdoff != 0xffffffff and cdoff + cdsize <= size:
+                    tailstart = size - taillen
+                    if cdoff >= tailstart:
+                        cdbytes = tail[cdoff - tailstart:cdoff - tailstart + cdsize]
+                    else:
+                        fd.seek(cdoff)
+                        cdbytes = fd.read(cdsize)
+                        nread += len(cdbytes)
+
+            if cdbytes is None and taillen < min(size, 65536 + zipfile.sizeEndCentDir):
+                # Hashed the same way as ever, so fingerprints already in
+                # the db still match.
+                taillen = min(size, 65536 + zipfile.sizeEndCentDir)
+                fd.seek(size - taillen)
+                tail = fd.read(taillen)
+                nread += len(tail)
+
+            # Zip64 or otherwise odd archives just get their tail hashed.
+            h.update(cdbytes if cdbytes is not None else tail)
+    elif atype == 2:
+        ao = rarfile.RarFile(cp)
+        try:
+            for rfi in ao.infolist():
+                nread += getattr(rfi, 'header_size', 0) or 0
+                h.update(('%s\0%d\0%s\0' % (rfi.filename, rfi.file_size, rfi.CRC)).encode('utf-8', 'surrogateescape'))
+        finally:
+            ao.close()
+    else:
+        return (None, nread)
+
+    return ('%d:%s' % (size, h.hexdigest()), nread)
+
+
+class _PoolEntry(object):
+    """ One parsed archive in the ArchivePool, plus what it was opened from.
+    """
+    __slots__ = ('path', 'ao', 'mtime', 'size', 'refcnt', 'retired', '_images')
+
+    def __init__(self, path, ao, st):
+        self.path = path
+        self.ao = ao
+        self.mtime = st.st_mtime
+        self.size = st.st_size
+        self.refcnt = 0
+        self.retired = False
+        self._images = None
+
+    def matches(self, st):
+        return (self.mtime == st.st_mtime) and (self.size == st.st_size)
+
+    def image_fns(self):
+        """ The archive's sorted image members, computed once per open. """
+        if self._images is None:
+            self._images = get_image_fns(self.ao)
+        return self._images
+
+
+class ArchivePool(object):
+    """ A bounded, thread-safe LRU of already-opened (and so already-parsed)
+    zip/rar archive objects, keyed by path.  An entry is thrown away as soon
+    as the file's mtime or size changes.  Archives that get evicted while
+    someone still has them checked out are only closed once they've been
+    released.
+    """
+
+    def __init__(self, maxsize=16):
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def resize(self, maxsize):
+        with self._lock:
+            self._maxsize = maxsize
+            self._trim()
+
+    def acquire(self, cp):
+        """ Returns a checked out _PoolEntry for the archive at cp (opening it
+        if needed), or None if cp isn't an archive.  Every entry returned has
+        to be handed back through release().
+        """
+        st = os.stat(cp)
+
+        with self._lock:
+            ent = self._entries.get(cp)
+            if ent is not None:
+                if ent.matches(st):
+                    self._entries.move_to_end(cp)
+                    ent.refcnt += 1
+                    return ent
+                del self._entries[cp]
+                self._retire(ent)
+
+        # Parse the archive without holding the lock, it can be slow.
+        ao = open_archive(cp)
+        if ao is None:
+            return None
+
+        newent = _PoolEntry(cp, ao, st)
+        newent.refcnt = 1
+
+        with self._lock:
+            ent = self._entries.get(cp)
+            if ent is not None and ent.matches(st):
+                # Another thread opened it first, use theirs.
+                ent.refcnt += 1
+                self._entries.move_to_end(cp)
+                ao.close()
+                return ent
+            elif ent is not None:
+                self._retire(ent)
+
+            self._entries[cp] = newent
+            self._trim()
+
+        return newent
+
+    def release(self, ent):
+        if ent is None:
+            return
+
+        with self._lock:
+            ent.refcnt -= 1
+            if ent.retired and ent.refcnt <= 0:
+                ent.ao.close()
+
+    @contextmanager
+    def checkout(self, cp):
+        """ with ARCHIVE_POOL.checkout(cp) as ent: ... ent.ao ...
+        ent is None if cp isn't a recognized archive.
+        """
+        ent = self.acquire(cp)
+        try:
+            yield ent
+        finally:
+            self.release(ent)
+
+    def clear(self):
+        with self._lock:
+            while len(self._entries) > 0:
+                k, ent = self._entries.popitem(last=False)
+                self._retire(ent)
+
+    def _trim(self):
+        while len(self._entries) > self._maxsize:
+            k, ent = self._entries.popitem(last=False)
+            self._retire(ent)
+
+    def _retire(self, ent):
+        ent.retired = True
+        if ent.refcnt <= 0:
+            ent.ao.close()
+
+    def _after_fork(self):
+        """ A forked child (ie: the thumbnail Pool workers) must not share the
+        parent's open file offsets, so it starts with an empty pool.  It gets
+        a new lock too, the parent's could have been held by another thread
+        when it forked, and nothing in the child would ever release it.
+        """
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+
+ARCHIVE_POOL = ArchivePool()
+
+
 def get_image_fns(ao):
     """ - Given ao (either rarfile or zipfile archive object)
     - return a sorted list of files that has an image ext and is > 0 bytes
@@ -58,52 +287,415 @@ def is_image_ext(fn):
     return ext in ['.jpg', '.jpeg', '.jpe', '.gif', '.png']
 
 
-def extract_cover_thumb(ao):
-    """ Given ao (rar/zip file archive object)
-    - Get the list of sorted image fns
-    - Extract the first from the list
+def image_mime_type(fn):
+    """ Returns the Content-Type to serve the image page fn with. """
+    bp, ext = os.path.splitext(fn)
+    ext = ext.lower()
+
+    if ext == '.png':
+        return 'image/png'
+    elif ext == '.gif':
+        return 'image/gif'
+
+    return 'image/jpeg'
+
+
+def is_solid(ao):
+    """ Returns true if ao is a solid RAR archive, where every member can only
+    be decompressed by first decompressing all of the ones before it.
+    """
+    return isinstance(ao, rarfile.RarFile) and ao.is_solid()
+
+
+def iter_solid_members(ao, stop_after=None, bufsize=65536):
+    """ Streams every file in the solid RAR archive ao out of a single
+    sequential unrar pass, rather than restarting unrar from the beginning of
+    the archive for each member (which is what ao.open() has to do).
+    - Yields (rarinfo, bytes) for each file, in archive order.
+    - If stop_after (a member name) is given, unrar is stopped as soon as that
+      member has been read.
+    - Raises IOError if unrar's output doesn't line up with the headers.
+    """
+    infos = [rfi for rfi in ao.infolist() if not rfi.isdir()]
+    args = [rarfile.UNRAR_TOOL, 'p', '-inul', '-p-', ao.filename]
+
+    proc = subprocess.Popen(args, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            bufsize=bufsize)
+    try:
+        for rfi in infos:
+            data = proc.stdout.read(rfi.file_size)
+            if len(data) != rfi.file_size:
+                raise IOError("unrar came up short on %s in %s" % (rfi.filename, ao.filename))
+
+            yield (rfi, data)
+
+            if stop_after is not None and rfi.filename == stop_after:
+                break
+    finally:
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+
+
+def comicinfo_member(ao):
+    """ Returns the info for ao's ComicInfo.xml, or None if it hasn't got one.
     """
-    allrfi = get_image_fns(ao)
+    for aoitem in ao.infolist():
+        if aoitem.filename.lower() == 'comicinfo.xml':
+            return aoitem
+    return None
+
+
+def extract_cover_info(ao, allrfi=None):
+    """ Given ao (rar/zip file archive object), pulls out both the cover and
+    ComicInfo.xml in one go.  Solid RARs get a single sequential pass that
+    stops at whichever of the two comes last.
+    - Returns (num_pages, cover BytesIO, ComicInfo.xml bytes or None).
+    """
+    if allrfi is None:
+        allrfi = get_image_fns(ao)
     num_pages = len(allrfi)
     if num_pages == 0:
-        return (0, None)
+        return (0, None, None)
+
+    tmpfn = allrfi[0].filename
+    cirfi = comicinfo_member(ao)
+    cover = None
+    xml = None
+
+    if is_solid(ao):
+        want = set([tmpfn])
+        if cirfi is not None:
+            want.add(cirfi.filename)
+        try:
+            for srfi, data in iter_solid_members(ao):
+                if srfi.filename == tmpfn:
+                    cover = BytesIO(data)
+                elif cirfi is not None and srfi.filename == cirfi.filename:
+                    xml = data
+                want.discard(srfi.filename)
+                if len(want) == 0:
+                    break
+        except (IOError, OSError):
+            log.warning("Sequential unrar of %s failed, falling back to rarfile.", ao.filename)
+            cover = None
+            xml = None
+
+    if cover is None:
+        with ao.open(tmpfn) as sf:
+            cover = BytesIO(sf.read())
+
+    if xml is None and cirfi is not None:
+        try:
+            with ao.open(cirfi) as sf:
+                xml = sf.read()
+        except:
+            log.warning("Couldn't read ComicInfo.xml from %s", ao.filename)
+
+    return (num_pages, cover, xml)
 
-    rfi = allrfi[0]
-    tmpfn = rfi.filename
-    with ao.open(tmpfn) as sf:
-        return (num_pages, BytesIO(sf.read()))
 
 def extract_comicinfo(ao):
-    for aoitem in ao.infolist():
-        if aoitem.filename.lower() == 'comicinfo.xml':
-            with ao.open(aoitem, 'r') as archread:
-                return archread.read()
+    aoitem = comicinfo_member(ao)
+    if aoitem is not None:
+        with ao.open(aoitem, 'r') as archread:
+            return archread.read()
     return None
-    
+
+
+def parse_comicinfo(xml):
+    """ Picks the fields gazee keeps out of a ComicInfo.xml document.
+    - Returns a dict with series, number, volume, summary and publisher
+      (any of which can be None), or None if xml doesn't parse.
+    """
+    if xml is None:
+        return None
+
+    try:
+        root = ElementTree.fromstring(xml)
+    except ElementTree.ParseError:
+        log.warning("Unable to parse ComicInfo.xml")
+        return None
+
+    info = {}
+    for key, tag in [('series', 'Series'), ('number', 'Number'),
+                     ('volume', 'Volume'), ('summary', 'Summary'),
+                     ('publisher', 'Publisher')]:
+        val = root.findtext(tag)
+        if val is not None:
+            val = val.strip()
+        info[key] = val if val else None
+
+    if info['volume'] is not None:
+        try:
+            info['volume'] = int(info['volume'], 10)
+        except ValueError:
+            info['volume'] = None
+
+    return info
+
 def find_comicinfo(fn):
-    atype = identify_arch(fn)
     try:
-        if atype == 1:
-            with zipfile.ZipFile(fn) as ao:
-                xml = extract_comicinfo(ao)
-        elif atype == 2:
-            with rarfile.RarFile(fn) as ao:
-                xml = extract_comicinfo(ao)
-        else:
-            return None
+        with ARCHIVE_POOL.checkout(fn) as ent:
+            if ent is None:
+                return None
+            xml = extract_comicinfo(ent.ao)
     except:
         traceback.print_exc(file=sys.stdout)
         return None
     
     return xml
 
-def extract_all_images(ao, outdir, imgpfx=''):
-    allrfi = get_image_fns(ao)
+def image_header_size(data):
+    """ Pulls (width, height) out of the header of a JPEG (SOF), PNG (IHDR) or
+    GIF (logical screen) image, given its first bytes.  No pixels are
+    decoded.
+    - Returns None if data ends before the size does.
+    - Raises ValueError if data isn't one of those formats.
+    """
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        if len(data) < 24:
+            return None
+        return struct.unpack('>II', data[16:24])
+
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        if len(data) < 10:
+            return None
+        return struct.unpack('<HH', data[6:10])
+
+    if data[:2] != b'\xff\xd8':
+        raise ValueError("Not a JPEG, PNG or GIF image")
+
+    i = 2
+    while True:
+        while i < len(data) and data[i] == 0xff:
+            i += 1
+        if i >= len(data):
+            return None
+
+        marker = data[i]
+        i += 1
+
+        if marker == 0x01 or 0xd0 <= marker <= 0xd8:
+            continue
+        if marker == 0xd9 or marker == 0xda:
+            raise ValueError("JPEG image data before any SOF marker")
+        if i + 2 > len(data):
+            return None
+
+        seglen = struct.unpack('>H', data[i:i + 2])[0]
+
+        if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            if i + 7 > len(data):
+                return None
+            h, w = struct.unpack('>HH', data[i + 3:i + 7])
+            return (w, h)
+
+        i += seglen
+
+
+def probe_page_sizes(cp, members, chunk=4096, maxbytes=262144):
+    """ Returns [(width, height), ...] for the page members of the archive at
+    cp, reading only as much of each page as it takes to get past the size in
+    its header.  Pages that can't be probed get (0, 0).
+    - Returns None if the archive can't be opened, or is a solid RAR, where
+      getting at the start of a page means decompressing all the ones
+      before it.
+    """
+    return probe_page_sizes_read(cp, members, chunk, maxbytes)[0]
+
+
+def probe_page_sizes_read(cp, members, chunk=4096, maxbytes=262144):
+    """ probe_page_sizes(), plus how many bytes of page data it read:
+    (sizes, nbytes).
+    """
+    sizes = []
+    nread = 0
+
+    try:
+        with ARCHIVE_POOL.checkout(cp) as ent:
+            if ent is None or is_solid(ent.ao):
+                return (None, 0)
+
+            for member in members:
+                res = None
+                data = b''
+                try:
+                    with ent.ao.open(member) as fd:
+                        want = chunk
+                        while res is None and len(data) < maxbytes:
+                            buf = fd.read(want - len(data))
+                            if not buf:
+                                break
+                            data += buf
+                            res = image_header_size(data)
+                            want = min(want * 2, maxbytes)
+                except Exception as e:
+                    log.debug("Unable to probe %s in %s: %s", member, cp, e)
+
+                nread += len(data)
+                sizes.append(res if res is not None else (0, 0))
+    except (OSError, zipfile.BadZipFile, rarfile.Error) as e:
+        log.warning("Unable to open %s to probe its pages: %s", cp, e)
+        return (None, nread)
+
+    return (sizes, nread)
+
+
+def page_index(allrfi):
+    """ Given the sorted image members of an archive, returns the rows of its
+    page index: (pagenum, member, header_offset, compress_size, file_size,
+    compress_type), with pagenum starting at 1.
+    """
+    pil = []
+
+    for page, rfi in enumerate(allrfi, 1):
+        pil.append((page, rfi.filename, getattr(rfi, 'header_offset', None),
+                    rfi.compress_size, rfi.file_size, rfi.compress_type))
+    return pil
+
+
+def get_page_index(cp):
+    """ Returns the page index rows (see page_index()) of the archive at cp, or
+    an empty list if it can't be read.
+    """
+    try:
+        with ARCHIVE_POOL.checkout(cp) as ent:
+            if ent is None:
+                return []
+            return page_index(ent.image_fns())
+    except:
+        traceback.print_exc(file=sys.stdout)
+        return []
+
+
+def is_solid_archive(cp):
+    """ Returns true if the archive at cp is a solid RAR. """
+    try:
+        with ARCHIVE_POOL.checkout(cp) as ent:
+            return ent is not None and is_solid(ent.ao)
+    except:
+        traceback.print_exc(file=sys.stdout)
+        return False
+
+
+def _stream_member(ent, rfi, bufsize):
+    """ Yields the bytes of rfi from the checked out ent, in bufsize chunks, and
+    hands ent back to the ARCHIVE_POOL when it's done.
+    """
+    try:
+        with ent.ao.open(rfi, 'r') as archread:
+            while True:
+                buf = archread.read(bufsize)
+                if not buf:
+                    break
+                yield buf
+    finally:
+        ARCHIVE_POOL.release(ent)
+
+
+def stored_member_range(cp, member, header_offset, file_size):
+    """ For a zip member that was written with ZIP_STORED, works out where its
+    raw bytes live in the file at cp by reading the member's local header at
+    header_offset.
+    - Returns (offset, length) of the page's bytes within cp.
+    - Returns None if the local header doesn't match what the page index says
+      (archive rewritten since, encrypted, compressed, not a zip), in which case
+      the member has to go through zipfile.
+    """
+    try:
+        with open(cp, 'rb') as fd:
+            fd.seek(header_offset)
+            hdr = fd.read(zipfile.sizeFileHeader)
+            if len(hdr) != zipfile.sizeFileHeader:
+                return None
+
+            fh = struct.unpack(zipfile.structFileHeader, hdr)
+            if fh[zipfile._FH_SIGNATURE] != zipfile.stringFileHeader:
+                return None
+
+            if fh[zipfile._FH_GENERAL_PURPOSE_FLAG_BITS] & 0x01:
+                return None
+
+            if fh[zipfile._FH_COMPRESSION_METHOD] != zipfile.ZIP_STORED:
+                return None
+
+            fnlen = fh[zipfile._FH_FILENAME_LENGTH]
+            extralen = fh[zipfile._FH_EXTRA_FIELD_LENGTH]
+            fname = fd.read(fnlen)
+    except OSError:
+        traceback.print_exc(file=sys.stdout)
+        return None
+
+    if fh[zipfile._FH_GENERAL_PURPOSE_FLAG_BITS] & 0x800:
+        fname = fname.decode('utf-8', 'replace')
+    else:
+        fname = fname.decode('cp437', 'replace')
+
+    if fname != member:
+        return None
+
+    offset = header_offset + zipfile.sizeFileHeader + fnlen + extralen
+
+    return (offset, file_size)
+
+
+def stream_file_range(cp, offset, length, bufsize=262144):
+    """ Yields length bytes of the file cp starting at offset, in bufsize
+    chunks.  Used to send stored zip members without going through zipfile
+    (no ZipExtFile, no shared file lock, no CRC pass).
+    """
+    with open(cp, 'rb', buffering=0) as fd:
+        fd.seek(offset)
+        remain = length
+
+        while remain > 0:
+            buf = fd.read(min(bufsize, remain))
+            if not buf:
+                break
+            remain -= len(buf)
+            yield buf
+
+
+def stream_member(cp, member, bufsize=65536):
+    """ Streams member (looked up by name, ie: from the page index, so the
+    archive's member list never has to be walked) of the archive at cp
+    without extracting anything to disk.
+    - Returns a tuple of (member info, generator), where the generator yields
+      the member's bytes in bufsize chunks and hands the archive back to the
+      ARCHIVE_POOL once it's exhausted.
+    - Returns (None, None) if the archive is unreadable or member isn't in it.
+    """
+    try:
+        ent = ARCHIVE_POOL.acquire(cp)
+    except:
+        traceback.print_exc(file=sys.stdout)
+        return (None, None)
+
+    if ent is None:
+        return (None, None)
+
+    try:
+        rfi = ent.ao.getinfo(member)
+    except KeyError:
+        log.error("%s is missing from %s", member, cp)
+        ARCHIVE_POOL.release(ent)
+        return (None, None)
+
+    return (rfi, _stream_member(ent, rfi, bufsize))
+
+
+def extract_all_images(ao, outdir, imgpfx='', allrfi=None):
+    if allrfi is None:
+        allrfi = get_image_fns(ao)
     ifiles = []
     page = 0
 
 #    numlen = math.trunc(math, log10(len(allrfi))) + 1
     num_extracted = 0
+    ofns = {}
 
     for rfi in allrfi:
         tbase, tmpext = os.path.splitext(rfi.filename)
@@ -112,40 +704,105 @@ def extract_all_images(ao, outdir, imgpfx=''):
         page += 1
         tfn = '%s%04d%s' % (imgpfx, page, tmpext)
         ofn = os.path.join(outdir, tfn)
+        ofns[rfi.filename] = ofn
+        ifiles.append(ofn)
+
+    if is_solid(ao):
+        # One unrar pass for the whole book instead of one per page.
+        try:
+            for rfi, data in iter_solid_members(ao):
+                ofn = ofns.get(rfi.filename)
+                if ofn is None:
+                    continue
+                with open(ofn, 'wb') as fd:
+                    fd.write(data)
+                    num_extracted += 1
+            return ifiles
+        except (IOError, OSError):
+            log.warning("Sequential unrar of %s failed, falling back to rarfile.", ao.filename)
 
+    for rfi in allrfi:
 #        print(ofn)
         with ao.open(rfi, 'r') as archread:
-            with open(ofn, 'wb') as fd:
+            with open(ofns[rfi.filename], 'wb') as fd:
                 fd.write(archread.read())
                 num_extracted += 1
-                ifiles.append(ofn)
 
 #    print("Extracted %d pages of to %s." % (num_extracted, outdir))
     return ifiles
 
+def draft_for_thumbs(im, reslist):
+    """ For a JPEG cover, has Pillow decode it at 1/2, 1/4 or 1/8 scale (DCT
+    scaling) instead of at full size, as long as that still leaves it at least
+    as big as the largest thumbnail in reslist.  Must be called before the
+    image is loaded.
+    """
+    if im.format != 'JPEG':
+        return
+
+    boxes = [(rx, ry) for rx, ry, opath in reslist if rx != 0]
+    if len(boxes) == 0:
+        return
+
+    tw = max([b[0] for b in boxes])
+    th = max([b[1] for b in boxes])
+
+    # Landscape covers get rotated before they're thumbnailed.
+    if (1.0 * im.width / im.height) > 1.15:
+        tw, th = th, tw
+
+    im.draft('RGB', (tw, th))
+    log.debug("Decoding cover at %dx%d for %dx%d thumbs.", im.width, im.height, tw, th)
+
+
 def extract_thumb(crl):
-    cp, cid, reslist, image_script, iprocscr = crl
+    cp, cid, reslist, image_script = crl
     num_pages = 0
-    atype = identify_arch(cp)
-    if atype is None:
-        return {'error': True, 'message': 'invalid archive', 'path': cp}
 
     try:
-        if atype == 1:
-            with zipfile.ZipFile(cp) as ao:
-                num_pages, sio = extract_cover_thumb(ao)
-        elif atype == 2:
-            with rarfile.RarFile(cp) as ao:
-                num_pages, sio = extract_cover_thumb(ao)
-        else:
-            return {'error': True, 'cid': cid, 'message': 'Unrecognized archive format', 'path': cp}
+        with ARCHIVE_POOL.checkout(cp) as ent:
+            if ent is None:
+                return {'error': True, 'cid': cid, 'errclass': 'InvalidArchive', 'message': 'invalid archive', 'path': cp}
+            allrfi = ent.image_fns()
+            num_pages, sio, xml = extract_cover_info(ent.ao, allrfi)
+            pages = page_index(allrfi)
+            solid = is_solid(ent.ao)
         if (num_pages == 0):
-            return {'error': True, 'cid': cid, 'message': 'This archive has no image files.', 'path': cp}
-    except:
+            return {'error': True, 'cid': cid, 'errclass': 'NoImages', 'message': 'This archive has no image files.', 'path': cp}
+    except Exception as e:
         traceback.print_exc(file=sys.stdout)
-        return {'error': True, 'cid': cid, 'message': 'Caught exception while processing archive', 'path': cp}
+        return {'error': True, 'cid': cid, 'errclass': type(e).__name__, 'message': 'Caught exception while processing archive: %s' % e, 'path': cp}
 
-    im = Image.open(sio)
+    try:
+        for rx, ry, opath in reslist:
+            if rx == 0:
+                with open(opath, 'wb') as fd:
+                    fd.write(sio.getvalue())
+
+        im = Image.open(sio)
+        ow, oh = im.size
+        draft_for_thumbs(im, reslist)
+        thumbres, tpath, rot = write_thumbs(im, reslist, image_script)
+    except Exception as e:
+        traceback.print_exc(file=sys.stdout)
+        return {'error': True, 'cid': cid, 'errclass': type(e).__name__, 'message': 'Unable to make a thumbnail of the cover: %s' % e, 'path': cp}
+
+    ratio = (1.0) * ow / oh
+    resd = {'error': False, 'cid': cid, 'num_pages': num_pages, 'owidth': ow, 'oheight': oh, 'ratio': ratio, 'twidth': thumbres[0], 'theight': thumbres[1], 'rot': rot, 'path': cp, 'tpath': tpath, 'pages': pages, 'solid': solid, 'info': parse_comicinfo(xml)}
+
+#    print("Saved thumb: %s" % opath)
+    return resd
+
+
+def write_thumbs(im, reslist, image_script):
+    """ Writes every (non-native) thumbnail size in reslist from the one
+    decoded cover im.  Sizes are made largest first, each one downsampled
+    from the one before it rather than from the full size cover.
+    - reslist is [(width, height, output path), ...]; (0, 0) entries (the
+      native cover) are skipped, they're written from the original bytes.
+    - Returns ((width, height), path, rotation) of the first thumbnail in
+      reslist, the one the all_comics row points at.
+    """
     if im.mode in ['RGBA', 'LA']:
         background = Image.new(im.mode[:-1], im.size)
         background.paste(im, im.split()[-1])
@@ -153,100 +810,80 @@ def extract_thumb(crl):
     elif im.mode in ('P'):
         im = im.convert('RGB')
 
-    writtenlist = []
-    tl = []
-    natpath = None
-    
-    for tli in reslist:
+    thumbs = [tli for tli in reslist if tli[0] != 0]
+    if len(thumbs) == 0:
+        return ((0, 0), None, 0)
+
+    ratio = (1.0) * im.width / im.height
+    rot = 0
+
+    if (ratio > 1.15):
+        # Landscape covers are turned on their side for the thumbnail.
+        rot = 90
+        ratio = 1.0 / ratio
+
+    src = im
+
+    for tli in sorted(thumbs, key=lambda x: x[0] * x[1], reverse=True):
         exact_resize = False
         rx, ry, opath = tli
-        if (rx != 0):
-            tgtratio = 1.0 * im.width / im.height
-        
         thumbres = (rx, ry)
-        w = im.width
-        h = im.height
-        
-        if (rx != 0):
-            nwid = round(tgtratio * ry)
-            widdiff = abs(nwid - rx)
-            if (widdiff < 6):
-                log.info("Difference is only %d", widdiff)
-                exact_resize = True
-            else:
-                log.info("Difference is %d", widdiff)
+
+        nwid = round(ratio * ry)
+        widdiff = abs(nwid - rx)
+        if (widdiff < 6):
+            log.info("Difference is only %d", widdiff)
+            exact_resize = True
         else:
-            sio.seek(0, 0)
-#            print("Position: %d" % sio.tell())
-            s = sio.read()
-            with open(opath, 'wb') as fd:
-                natpath = opath
-                fd.write(s)
-            t = (cid, opath)
-            continue
-        
-        mkregthumb = True
-        
-        if not exact_resize and image_script != 0:
-            if not os.path.exists(iprocscr):
-                log.error("Requested the image script, but can't find it - it must be in your current directory.")
-                return None
-            else:
-                log.debug("Making a script processed thumbnail for cid: %s", cid)
-                if os.path.exists(iprocscr) and image_script != 0:
-                    args = ['/bin/bash', iprocscr, '-T', '%dx%d' % (rx,ry), natpath, opath]
-                    
-                    process = subprocess.Popen(args, shell=False)
-                    process.wait()
-                    mkregthumb = False
+            log.info("Difference is %d", widdiff)
+
+        # The box in src's orientation, which is unrotated.
+        box = (ry, rx) if rot else thumbres
+
+        if exact_resize:
+            level = src.resize(box, resample = Image.LANCZOS)
         else:
-            log.debug("Making regular olde thumbnails.")
-        
-        copyim = im.copy()
-        w = copyim.width
-        h = copyim.height
-        ratio = (1.0) * w / h
-        rot = 0
-
-        if (ratio > 1.15):
-            rot = 90
-            if mkregthumb:
-                rcopyim = copyim.rotate(rot, Image.BICUBIC, 1)
-                if exact_resize:
-                    rcopyim = rcopyim.resize(thumbres, resample = Image.LANCZOS)
-                else:
-                    rcopyim.thumbnail(thumbres)
-                rcopyim.save(opath, quality=85)
+            level = src.copy()
+            level.thumbnail(box)
+
+        if not exact_resize and image_script != 0:
+            log.debug("Making a bordered %dx%d thumbnail.", rx, ry)
+            image_border(src, rx, ry).save(opath, quality=85)
         else:
-            if mkregthumb:
-                if exact_resize:
-                    copyim = copyim.resize(thumbres, resample = Image.LANCZOS)
-                else:
-                    copyim.thumbnail(thumbres)
-                copyim.save(opath, quality=85)
+            log.debug("Making a regular olde %dx%d thumbnail.", rx, ry)
+            if rot:
+                level.rotate(rot, Image.BICUBIC, 1).save(opath, quality=85)
+            else:
+                level.save(opath, quality=85)
 
-    resd = {'error': False, 'cid': cid, 'num_pages': num_pages, 'owidth': w, 'oheight': h, 'ratio': ratio, 'twidth': thumbres[0], 'theight': thumbres[1], 'rot': rot, 'path': cp, 'tpath': opath}
+        src = level
 
-#    print("Saved thumb: %s" % opath)
-    return resd
+    return ((thumbs[0][0], thumbs[0][1]), thumbs[0][2], rot)
+
+
+def thumbs_from_native(natpath, reslist, image_script):
+    """ Remakes the thumbnails in reslist from an already extracted native
+    cover, without touching the archive.  Returns False if it can't.
+    """
+    try:
+        im = Image.open(natpath)
+        draft_for_thumbs(im, reslist)
+        write_thumbs(im, reslist, image_script)
+    except:
+        traceback.print_exc(file=sys.stdout)
+        return False
+
+    return True
 
 
 def extract_archive(cp, temppath, pfx):
-    atype = identify_arch(cp)
     ifiles = []
-    if atype is None:
-        return {'error': True, 'message': 'invalid archive', 'path': cp}
 
     try:
-        if atype == 1:
-            with zipfile.ZipFile(cp) as ao:
-                ifiles = extract_all_images(ao, temppath, pfx)
-        elif atype == 2:
-            with rarfile.RarFile(cp) as ao:
-                ifiles = extract_all_images(ao, temppath, pfx)
-        else:
-            raise (ValueError, "Invalid archive type: %d" % atype)
-            return {'error': True, 'message': 'Unrecognized archive format', 'path': cp}
+        with ARCHIVE_POOL.checkout(cp) as ent:
+            if ent is None:
+                return {'error': True, 'message': 'invalid archive', 'path': cp}
+            ifiles = extract_all_images(ent.ao, temppath, pfx, ent.image_fns())
     except:
         raise ((ValueError, "Broken / Illegal file in archive."))
         traceback.print_exc(file=sys.stdout)
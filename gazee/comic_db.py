@@ -16,9 +16,16 @@ import math
 import glob
 import time
 import logging
+import threading
+import concurrent.futures
+import multiprocessing
+from collections import deque
 from multiprocessing import Pool
-from gazee.archive import extract_thumb, extract_archive
+from multiprocessing.pool import ThreadPool
+from gazee.archive import archive_fingerprint_read, extract_thumb, thumbs_from_native, probe_page_sizes_read, extract_archive, get_page_index, stream_member, stored_member_range, stream_file_range, is_solid_archive
 from gazee.db import gazee_db
+from gazee.jobctl import JobControl
+from gazee.pathindex import PathIndex, FileIndex
 from gazee.filenameparser import FileNameParser
 import gazee.config
 
@@ -42,10 +49,34 @@ def sizestr(num, dplaces=2, minunit=False):
 
 
 class comic_db(gazee_db):
-    SCHEMA_VERSION = 2
-    dir_cache = {}
-    fn_cache = {}
+    SCHEMA_VERSION = 9
+    # Archives that won't thumbnail get retried after an hour, then two,
+    # four... up to a month.
+    THUMB_RETRY_BASE = 3600
+    THUMB_RETRY_MAX = 30 * 86400
+    # Scans can always purge this many missing comics, however few of
+    # them purge_max_pct allows.
+    PURGE_MIN = 50
+    # Threads making covers on demand, for /cover requests.
+    COVER_WORKERS = 4
+    dir_cache = PathIndex()
+    dir_info = {}
+    dir_children = {}
+    fn_cache = FileIndex()
+    missing_comics = {}
+    missing_fps = {}
+    stale_dirs = []
     last_thumb_time = None
+    series_cache = {}
+    pub_cache = {}
+    _thumb_pool = None
+    _thumb_engine = None
+    _thumb_nproc = 0
+    _thumb_abort = False
+    _thumb_created = 0
+    _thumb_cursor = 0
+    _scan_rows = 0
+    _scan_since = 0
 
     c = None
 
@@ -54,6 +85,16 @@ class comic_db(gazee_db):
         self.init_db()
         self.fnp = FileNameParser()
         self.reset_unprocessed_thumbs()
+        self.series_cache = {}
+        self.pub_cache = {}
+        self._prio = deque()
+        self._prio_set = set()
+        self._prio_lock = threading.Lock()
+        self._cover_flights = {}
+        self._flight_lock = threading.RLock()
+        self._cover_pool = None
+        self.jobctl = JobControl(gazee.config.SCAN_MAX_MBPS,
+                                 gazee.config.READER_PAUSE)
 
         self._pending = 0
         self._numrecs = 0
@@ -68,9 +109,9 @@ class comic_db(gazee_db):
         
     def create_db(self):
         conn = sqlite3.connect(self.dbpath)
-        sql = '''CREATE TABLE IF NOT EXISTS all_directories(dirid INTEGER PRIMARY KEY AUTOINCREMENT, parentid INTEGER NOT NULL, full_dir_path TEXT NOT NULL);
+        sql = '''CREATE TABLE IF NOT EXISTS all_directories(dirid INTEGER PRIMARY KEY AUTOINCREMENT, parentid INTEGER NOT NULL, full_dir_path TEXT NOT NULL, mtime REAL);
 CREATE TABLE IF NOT EXISTS dir_names(dirid INTEGER PRIMARY KEY, nice_name TEXT NOT NULL, dir_image TEXT NOT NULL);
-CREATE TABLE IF NOT EXISTS all_comics(comicid INTEGER PRIMARY KEY AUTOINCREMENT, dirid INTEGER NOT NULL, filename TEXT NOT NULL COLLATE NOCASE, filesize INTEGER DEFAULT 0, pages integer DEFAULT 0, image TEXT, seriesid integer NOT NULL, issue INTEGER, publisher integer, volume INTEGER, summary TEXT, width integer, height integer, ratio real, adddate datetime DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE IF NOT EXISTS all_comics(comicid INTEGER PRIMARY KEY AUTOINCREMENT, dirid INTEGER NOT NULL, filename TEXT NOT NULL COLLATE NOCASE, filesize INTEGER DEFAULT 0, pages integer DEFAULT 0, image TEXT, seriesid integer NOT NULL, issue INTEGER, publisher integer, volume INTEGER, summary TEXT, width integer, height integer, ratio real, adddate datetime DEFAULT CURRENT_TIMESTAMP, solid INTEGER DEFAULT 0, fingerprint TEXT);
 CREATE TABLE IF NOT EXISTS comic_series(seriesid INTEGER PRIMARY KEY AUTOINCREMENT, collname TEXT NOT NULL, name TEXT NOT NULL);
 INSERT INTO comic_series(seriesid, collname, name) VALUES (1, "unknown", "Unknown");
 CREATE TABLE IF NOT EXISTS publishers (pubid integer primary key autoincrement, name);
@@ -81,7 +122,11 @@ CREATE INDEX IF NOT EXISTS comicdir ON all_comics(dirid, filename ASC);
 CREATE INDEX IF NOT EXISTS thumbproc ON all_comics(image ASC);
 CREATE INDEX IF NOT EXISTS seriesnum on all_comics(seriesid ASC);
 CREATE INDEX IF NOT EXISTS seriesord on comic_series(name ASC);
-CREATE INDEX IF NOT EXISTS seriescollord on comic_series(collname ASC);'''
+CREATE INDEX IF NOT EXISTS seriescollord on comic_series(collname ASC);
+CREATE INDEX IF NOT EXISTS comicfp ON all_comics(fingerprint);
+CREATE TABLE IF NOT EXISTS comic_pages(comicid INTEGER NOT NULL, pagenum INTEGER NOT NULL, member TEXT NOT NULL, header_offset INTEGER, compress_size INTEGER, file_size INTEGER, compress_type INTEGER, width INTEGER, height INTEGER, PRIMARY KEY(comicid, pagenum));
+CREATE TABLE IF NOT EXISTS job_state(name TEXT PRIMARY KEY, cursor INTEGER DEFAULT 0, updated datetime DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE IF NOT EXISTS thumb_failures(comicid INTEGER PRIMARY KEY, errclass TEXT, message TEXT, attempts INTEGER DEFAULT 0, last_try datetime DEFAULT CURRENT_TIMESTAMP, next_try REAL);'''
         log.debug("Executing creation of SQL database: %s with SQL: %s",
                   self.dbpath, sql)
         conn.executescript(sql)
@@ -100,6 +145,38 @@ CREATE INDEX IF NOT EXISTS seriescollord on comic_series(collname ASC);'''
                     q = ''''''
                     conn.execute(q)
                     conn.commit()
+                elif 3 == curver:
+                    q = '''CREATE TABLE IF NOT EXISTS comic_pages(comicid INTEGER NOT NULL, pagenum INTEGER NOT NULL, member TEXT NOT NULL, header_offset INTEGER, compress_size INTEGER, file_size INTEGER, compress_type INTEGER, PRIMARY KEY(comicid, pagenum));'''
+                    conn.executescript(q)
+                    conn.commit()
+                elif 4 == curver:
+                    q = '''ALTER TABLE all_comics ADD COLUMN solid INTEGER DEFAULT 0;'''
+                    conn.execute(q)
+                    conn.commit()
+                elif 5 == curver:
+                    q = '''ALTER TABLE comic_pages ADD COLUMN width INTEGER;
+ALTER TABLE comic_pages ADD COLUMN height INTEGER;'''
+                    conn.executescript(q)
+                    conn.commit()
+                elif 6 == curver:
+                    q = '''ALTER TABLE all_comics ADD COLUMN fingerprint TEXT;
+CREATE INDEX IF NOT EXISTS comicfp ON all_comics(fingerprint);'''
+                    conn.executescript(q)
+                    conn.commit()
+                elif 7 == curver:
+                    q = '''CREATE TABLE IF NOT EXISTS job_state(name TEXT PRIMARY KEY, cursor INTEGER DEFAULT 0, updated datetime DEFAULT CURRENT_TIMESTAMP);'''
+                    conn.execute(q)
+                    conn.commit()
+                elif 8 == curver:
+                    q = '''CREATE TABLE IF NOT EXISTS thumb_failures(comicid INTEGER PRIMARY KEY, errclass TEXT, message TEXT, attempts INTEGER DEFAULT 0, last_try datetime DEFAULT CURRENT_TIMESTAMP, next_try REAL);'''
+                    conn.execute(q)
+                    conn.commit()
+                elif 9 == curver:
+                    # No mtimes yet, so the first scan lists everything (and
+                    # straightens out the parentids).
+                    q = '''ALTER TABLE all_directories ADD COLUMN mtime REAL;'''
+                    conn.execute(q)
+                    conn.commit()
 
         self.set_schema_version(self.SCHEMA_VERSION)
 
@@ -115,18 +192,47 @@ CREATE INDEX IF NOT EXISTS seriescollord on comic_series(collname ASC);'''
             
         return row[0]
 
-    def add_dir_entry(self, parentid, p):
-        param = (parentid, os.path.normpath(p))
-        sql = '''INSERT INTO all_directories(parentid, full_dir_path) VALUES (?, ?)'''
+    def get_directory_paths(self):
+        """ Every directory the scan knows about. """
+        sql = '''SELECT DISTINCT full_dir_path FROM all_directories'''
         with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as conn:
-            curs = conn.cursor()
+            return [row[0] for row in conn.execute(sql)]
 
-            curs.execute(sql, param)
+    def add_dir_entry(self, parentid, p):
+        with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as conn:
+            did = self._insert_dir(conn, parentid, p)
             conn.commit()
-        
-        did = curs.lastrowid
+
         return did
 
+    def _insert_dir(self, conn, parentid, p):
+        """ Adds directory p on conn, leaving committing to the caller. """
+        param = (parentid, os.path.normpath(p))
+        sql = '''INSERT INTO all_directories(parentid, full_dir_path) VALUES (?, ?)'''
+        curs = conn.cursor()
+        curs.execute(sql, param)
+        return curs.lastrowid
+
+    def _scan_wrote(self, con, nrows):
+        """ Counts the rows a scan has written on con, and commits them once
+        there are scan_batch of them, or the oldest has waited a couple of
+        seconds (so nobody else is locked out of the db for long while the
+        scan's waiting on a slow share).
+        """
+        if nrows > 0 and self._scan_rows == 0:
+            self._scan_since = time.time()
+        self._scan_rows += nrows
+
+        if self._scan_rows > 0 and (self._scan_rows >= gazee.config.SCAN_BATCH or
+                                    time.time() - self._scan_since > 2):
+            self._scan_flush(con)
+
+    def _scan_flush(self, con):
+        """ Commits whatever the scan has written on con so far. """
+        if self._scan_rows > 0:
+            con.commit()
+            self._scan_rows = 0
+
     def get_all_books_in_dirid(self, dirid):
         with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as conn:
             curs = conn.cursor()
@@ -159,64 +265,186 @@ CREATE INDEX IF NOT EXISTS seriescollord on comic_series(collname ASC);'''
             shutil.rmtree(dp)
 
     def delete_stale_directory_entries(self):
-        self.fn_cache = {}
-        self.dir_cache = {}
+        """ Reloads dir_cache, dir_info, dir_children and fn_cache from the
+        database, and forgets about what went missing last time.  Nothing's
+        looked at on disk: scan_directory_tree() works out what's gone from
+        the directories it finds changed, and moves missing comics to
+        wherever the same fingerprint turns up, then purge_missing_comics()
+        drops the rest.
+        - dir_info is {dirid: (parentid, mtime)}, the paths are only kept
+          in dir_cache (see PathIndex.path()).
+        """
+        self.fn_cache = FileIndex()
+        self.dir_cache = PathIndex()
+        self.dir_info = {}
+        self.dir_children = {}
+        self.missing_comics = {}
+        self.missing_fps = {}
+        self.stale_dirs = []
+
+        # Older scans could add the same (empty) directory more than once.
+        # The copy with comics in it, or else the first one, is the one kept,
+        # the rest never get visited so they're dropped as stale.
+        psql = '''SELECT d.full_dir_path, d.dirid FROM all_directories d ORDER BY EXISTS (SELECT 1 FROM all_comics c WHERE c.dirid=d.dirid) DESC, d.dirid ASC;'''
+        dsql = '''SELECT dirid, parentid, mtime FROM all_directories;'''
+        csql = '''SELECT dirid, comicid, filename FROM all_comics ORDER BY dirid;'''
 
-        sql = '''SELECT * FROM comicdirs ORDER BY dirid ASC, comicid ASC;'''
+        with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as conn:
+            self.dir_cache = PathIndex(conn.execute(psql))
+            for did, parentid, mtime in conn.execute(dsql):
+                self.dir_info[did] = (parentid, mtime)
+                if self.dir_cache.get(self.dir_cache.path(did)) == did:
+                    self.dir_children.setdefault(parentid, []).append(did)
 
-        deldl = []
-        delcl = []
+            self.fn_cache = FileIndex(conn.execute(csql))
+
+        return
+
+    def _note_missing(self, did, cids):
+        """ Adds the comics cids, from directory did, to missing_comics.
+        Their paths get filled in by _load_missing_fps().
+        """
+        for cid in cids:
+            self.missing_comics[cid] = did
+
+    def _load_missing_fps(self):
+        """ Fills in missing_fps, and the paths, for everything in
+        missing_comics.
+        """
+        self.missing_fps = {}
+        cids = list(self.missing_comics)
+        sql = '''SELECT comicid, filename, fingerprint FROM all_comics WHERE comicid IN (%s)'''
 
         with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as conn:
-            curs = conn.cursor()
+            for i in range(0, len(cids), 500):
+                chunk = cids[i:i + 500]
+                for cid, fn, fprint in conn.execute(sql % ','.join('?' * len(chunk)), chunk):
+                    did = self.missing_comics[cid]
+                    dp = self.dir_cache.path(did, '')
+                    self.missing_comics[cid] = os.path.join(dp, fn)
+                    if fprint is not None:
+                        self.missing_fps.setdefault(fprint, []).append(cid)
+
+        if len(self.missing_comics) > 0:
+            log.info("%d comics have gone missing, %d of them can be matched "
+                     "up if they were moved.", len(self.missing_comics),
+                     sum(len(v) for v in self.missing_fps.values()))
+
+    def purge_missing_comics(self):
+        """ Deletes the comics (and their covers and page indexes) that went
+        missing and didn't turn up anywhere else during the scan, along with
+        directories that are gone and have nothing left in them.
+        """
+        delcl = [(cid, ) for cid in self.missing_comics]
+        deldl = [(did, did) for did in self.stale_dirs]
+
+        numdel = 0
+        for cid in self.missing_comics:
+            cachepath = self.get_cache_path(cid)
+            for pat in ("/%d-*.jpg", "/p%d-*.jpg"):
+                for cp in glob.glob(cachepath + pat % cid):
+                    if os.path.exists(cp):
+                        os.unlink(cp)
+                        numdel += 1
 
-            dn = None
-            for row in curs.execute(sql):
-                did, cid, fp, image = row
+        with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as conn:
+            sql = '''DELETE FROM comic_pages WHERE comicid=?'''
+            conn.executemany(sql, delcl)
+            sql = '''DELETE FROM thumb_failures WHERE comicid=?'''
+            conn.executemany(sql, delcl)
+            sql = '''DELETE FROM all_comics WHERE comicid=?'''
+            conn.executemany(sql, delcl)
+            sql = '''DELETE FROM all_directories WHERE dirid=? AND NOT EXISTS (SELECT 1 FROM all_comics WHERE dirid=?)'''
+            conn.executemany(sql, deldl)
+            conn.commit()
 
-                fdp, fn = os.path.split(fp)
+        if len(delcl) > 0:
+            log.info("Deleted %d missing comics and %d covers.", len(delcl), numdel)
+
+        self.missing_comics = {}
+        self.missing_fps = {}
+        self.stale_dirs = []
+
+    def _fingerprint_new(self, cfn, filebytes):
+        """ Runs in the scan's threads.  Returns (fingerprint, bytes read),
+        the fingerprint being None if cfn couldn't be read.
+        """
+        try:
+            return archive_fingerprint_read(cfn, filebytes)
+        except:
+            log.warning("Unable to fingerprint %s", cfn)
+            return (None, 0)
+
+    def find_moved_comic(self, cfn, fprint):
+        """ Returns the comicid of the missing comic the new file cfn, with
+        fingerprint fprint, is a moved copy of, or None.
+        """
+        cids = self.missing_fps.get(fprint)
+        if not cids:
+            return None
+
+        cid = cids.pop(0)
+        if len(cids) == 0:
+            del self.missing_fps[fprint]
+        log.info("%s was moved to %s", self.missing_comics.pop(cid), cfn)
+        return cid
+
+    def do_fingerprint_job(self):
+        """ Fills in the fingerprint of comics added before there were any.
+        """
+        done = 0
+        cursor = 0
+        sql = '''SELECT c.comicid, d.full_dir_path || '/' || c.filename, c.filesize FROM all_comics c INNER JOIN all_directories d ON (c.dirid=d.dirid) WHERE c.fingerprint IS NULL AND c.comicid > ? ORDER BY c.comicid ASC LIMIT 200'''
+        usql = '''UPDATE all_comics SET fingerprint=? WHERE comicid=?'''
 
-                if not os.path.exists(fp):
-                    delcl.append((did, ))
+        while True:
+            with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
+                rv = con.execute(sql, (cursor, )).fetchall()
 
-                if dn != did:
-                    dn = did
-                    if not os.path.exists(fdp) or not os.path.isdir(fdp):
-                        log.info('The pathname %s (dirid: %d) no longer exists.',
-                                 fdp, did)
-                        deldl.append((did, ))
-                        delcl.append((did, ))
-                    else:
-                        self.dir_cache[fdp] = did
+            if len(rv) == 0:
+                break
 
-                if did not in self.fn_cache:
-                    self.fn_cache[did] = {fn: cid}
-                else:
-                    self.fn_cache[did][fn] = cid
-
-            delthumbcl = []
-
-            if len(delcl) > 0:
-                numdel = 0
-                for did in deldl:
-                    sql = '''SELECT comicid FROM all_comics WHERE dirid=?'''
-                    for row in conn.execute(sql, (did, )):
-                        cid = row[0]
-                        delthumbcl.append((cid))
-                        cachepath = self.get_cache_path(cid)
-                        for cp in glob.glob(cachepath + "/%d-*.jpg" % cid):
-                            if os.path.exists(cp):
-                                os.unlink(cp)
-                                numdel += 1
-
-                log.info("Deleted %d covers." % numdel)
-                sql = '''DELETE FROM all_directories WHERE (dirid=?)'''
-                conn.executemany(sql, deldl)
-                sql = '''DELETE FROM all_comics WHERE (dirid=?)'''
-                conn.executemany(sql, delcl)
-                conn.commit()
+            params = []
+            nread = 0
+            for cid, cfn, filebytes in rv:
+                if not self.jobctl.checkpoint(nread):
+                    break
+                # The ones that fail are left for the next pass.
+                cursor = cid
+                try:
+                    fprint, nread = archive_fingerprint_read(cfn)
+                except:
+                    fprint, nread = None, 0
+                if fprint is not None:
+                    params.append((fprint, cid))
+
+            with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
+                con.executemany(usql, params)
+                con.commit()
+            done += len(params)
+
+            if self.jobctl.cancelled:
+                log.info("Fingerprinting cancelled.")
+                break
 
-        return
+        log.info("Fingerprinted %d comics...", done)
+        return True
+
+    def get_job_cursor(self, name):
+        """ Where the background job name got to last time (a comicid), so a
+        restart can pick up from there.  0 if it finished, or never ran.
+        """
+        sql = '''SELECT cursor FROM job_state WHERE name=?'''
+        with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
+            row = con.execute(sql, (name, )).fetchone()
+
+        return row[0] if row is not None else 0
+
+    def set_job_cursor(self, name, cursor):
+        sql = '''INSERT OR REPLACE INTO job_state(name, cursor, updated) VALUES (?, ?, CURRENT_TIMESTAMP)'''
+        with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
+            con.execute(sql, (name, cursor))
+            con.commit()
 
     def get_cache_path(self, cid, twid=-1, tht=-1, forceproc=0):
         CACHE_PER_DIR = 512
@@ -247,6 +475,150 @@ CREATE INDEX IF NOT EXISTS seriescollord on comic_series(collname ASC);'''
 
         return cp2
 
+    def get_thumb_ladder(self):
+        """ Returns the [(width, height), ...] cover sizes that get made for
+        every comic, the configured thumb size first, then the rest of the
+        thumb_ladder widths (largest to smallest), in the same aspect.
+        """
+        thumbsize = (gazee.config.THUMB_MAXWIDTH, gazee.config.THUMB_MAXHEIGHT)
+        ladder = [thumbsize]
+
+        for wstr in str(getattr(gazee.config, 'THUMB_LADDER', '')).split(','):
+            wstr = wstr.strip()
+            if wstr == '':
+                continue
+            try:
+                w = int(wstr, 10)
+            except ValueError:
+                log.warning("Ignoring bad thumb_ladder width: %s", wstr)
+                continue
+            if w <= 0:
+                continue
+            res = (w, int(round(1.0 * w * thumbsize[1] / thumbsize[0])))
+            if res not in ladder:
+                ladder.append(res)
+
+        return ladder[:1] + sorted(ladder[1:], reverse=True)
+
+    def get_thumb_reslist(self, cid, native=True):
+        """ The (width, height, output path) list extract_thumb wants for cid.
+        """
+        tl = []
+        resl = self.get_thumb_ladder()
+        if native:
+            resl = [(0, 0)] + resl
+
+        for rx, ry in resl:
+            fprc = 2 if rx == 0 else 1
+            opath = self.get_cache_path(cid, rx, ry, fprc)
+            tl.append((rx, ry, opath))
+
+        return tl
+
+    def get_cover_path(self, cid, wid=0):
+        """ Path of the smallest cached cover at least wid pixels wide, or of
+        the configured thumb size if wid isn't given (or nothing is that big).
+        """
+        ladder = self.get_thumb_ladder()
+        res = ladder[0]
+        if wid > 0:
+            for lres in sorted(ladder):
+                if lres[0] >= wid:
+                    res = lres
+                    break
+
+        cpath = self.get_cache_path(cid, res[0], res[1])
+        if res != ladder[0] and not os.path.exists(cpath):
+            cpath = self.get_cache_path(cid, ladder[0][0], ladder[0][1])
+        return cpath
+
+    def make_cover(self, cid):
+        """ Makes any of comicid cid's cover sizes that are missing, right now.
+        They come from the native cover if it's been extracted already,
+        otherwise the comic gets the whole extract_thumb() treatment (and its
+        results stored) on the spot.  Returns True if it worked.
+        """
+        missing = []
+        for rx, ry, opath in self.get_thumb_reslist(cid, native=False):
+            tpt = self.get_cache_path(cid, rx, ry, 3)
+            if not os.path.exists(tpt[0]) and not os.path.exists(tpt[1]):
+                missing.append((rx, ry, opath))
+
+        if len(missing) == 0:
+            return True
+
+        natpath = self.get_cache_path(cid, 0, 0, 2)
+        if (os.path.exists(natpath) and
+           thumbs_from_native(natpath, missing, gazee.config.IMAGE_SCRIPT)):
+            return True
+
+        if self.is_quarantined(cid):
+            return False
+
+        comicpath = self.get_comic_path(cid)
+        if comicpath is None:
+            return False
+
+        edict = extract_thumb((comicpath, cid, self.get_thumb_reslist(cid),
+                               gazee.config.IMAGE_SCRIPT))
+
+        if edict.get('error'):
+            log.error("CID: %s returned the error: %s.", cid, edict.get('message'))
+            self.store_thumb_results([], [edict])
+            return False
+
+        series, issue = self._filename_meta(comicpath)
+        self.store_thumb_results([(edict, series, issue)])
+        return True
+
+    def make_cover_wait(self, cid, timeout):
+        """ Runs make_cover(cid) on the cover threads, waiting up to timeout
+        seconds for it.  Requests for a cid that's already being made share
+        that one job instead of starting another.
+        - Returns True/False from make_cover(), or None if it's still going,
+          or if every cover thread is already busy.  Nothing queues up
+          behind them: that would just tie up the web server's threads
+          waiting, so the caller should fall back to the thumbnail job.
+        """
+        with self._flight_lock:
+            fut = self._cover_flights.get(cid)
+            if fut is None:
+                if len(self._cover_flights) >= self.COVER_WORKERS:
+                    log.debug("Cover threads are busy, not waiting on cid %d.", cid)
+                    return None
+                if self._cover_pool is None:
+                    self._cover_pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.COVER_WORKERS)
+                fut = self._cover_pool.submit(self.make_cover, cid)
+                self._cover_flights[cid] = fut
+                fut.add_done_callback(lambda f: self._end_cover_flight(cid, f))
+
+        try:
+            return fut.result(timeout)
+        except concurrent.futures.TimeoutError:
+            log.info("Cover for cid %d is taking longer than %s seconds.", cid, timeout)
+            return None
+        except concurrent.futures.CancelledError:
+            # close_cover_pool() got to it first.
+            return None
+        except:
+            log.exception("Unable to make the cover for cid %d", cid)
+            return False
+
+    def _end_cover_flight(self, cid, fut):
+        with self._flight_lock:
+            if self._cover_flights.get(cid) is fut:
+                del self._cover_flights[cid]
+
+    def close_cover_pool(self):
+        """ Stops the cover threads, dropping the covers that haven't been
+        started.  The ones being made are left to finish on their own.
+        """
+        with self._flight_lock:
+            if self._cover_pool is not None:
+                log.info("Stopping the cover threads.")
+                self._cover_pool.shutdown(wait=False, cancel_futures=True)
+                self._cover_pool = None
+
     def reset_missing_covers(self, wid, ht):
         timenow = time.time()
 
@@ -255,64 +627,466 @@ CREATE INDEX IF NOT EXISTS seriescollord on comic_series(collname ASC);'''
             log.debug("Too soon after a thumb to reset_missing_covers()")
             return
 
+        ladder = self.get_thumb_ladder()
+        if (wid, ht) not in ladder:
+            ladder.insert(0, (wid, ht))
+
+        # Once a pass has been through every comic with this ladder, only
+        # the first size is looked for (the whole ladder gets made at once,
+        # so the rest are there if it is).  A new ladder has every size
+        # checked, once.
+        ladderjob = 'covers ' + ','.join('%dx%d' % res for res in ladder)
+        sentinel = self.get_job_cursor(ladderjob) == 1
+
         resetids = []
+        remade = 0
+        checked = 0
+        cursor = self.get_job_cursor('covers')
+        if cursor > 0:
+            log.info("Resuming the cover check from cid %d", cursor)
+
         with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
-            sql = '''SELECT comicid FROM all_comics WHERE image is not null;'''
-            for row in con.execute(sql):
-                cid = row[0]
-                tpt = self.get_cache_path(cid, wid, ht, 3)
+            sql = '''SELECT comicid FROM all_comics WHERE image is not null AND comicid > ? AND comicid NOT IN (SELECT comicid FROM thumb_failures) ORDER BY comicid ASC;'''
+            rows = con.execute(sql, (cursor, )).fetchall()
+
+        for row in rows:
+            cid = row[0]
+            checked += 1
+            if (checked % 500) == 0:
+                self.set_job_cursor('covers', cid - 1)
+            if not self.jobctl.checkpoint():
+                self.set_job_cursor('covers', cid - 1)
+                break
+            if sentinel:
+                tpt = self.get_cache_path(cid, ladder[0][0], ladder[0][1], 3)
+                if os.path.exists(tpt[0]) or os.path.exists(tpt[1]):
+                    continue
+
+            missing = []
+            for rx, ry in ladder:
+                tpt = self.get_cache_path(cid, rx, ry, 3)
                 if not os.path.exists(tpt[0]) and not os.path.exists(tpt[1]):
-                    resetids.append((cid, ))
+                    missing.append((rx, ry, tpt[0]))
+
+            if len(missing) == 0:
+                continue
 
-        log.info("Resetting %d image fields to add in support"
-                 "for thumbs that are %dx%d.", len(resetids), wid, ht)
+            # The native cover is kept around, so new sizes can be made
+            # from it without going back to the archive.
+            natpath = self.get_cache_path(cid, 0, 0, 2)
+            if (os.path.exists(natpath) and
+               thumbs_from_native(natpath, missing, gazee.config.IMAGE_SCRIPT)):
+                self.jobctl.checkpoint(os.path.getsize(natpath))
+                remade += 1
+                continue
+
+            resetids.append((cid, ))
+        else:
+            self.set_job_cursor('covers', 0)
+            if not sentinel and cursor == 0:
+                self.set_job_cursor(ladderjob, 1)
+
+        log.info("Remade %d covers from their native images, resetting %d "
+                 "image fields to add in support for thumbs that are %dx%d.",
+                 remade, len(resetids), wid, ht)
 
         sql = '''UPDATE all_comics SET image=null WHERE comicid=?'''
 
         with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
             con.executemany(sql, resetids)
             con.commit()
-            
+
+    def _links_up(self, dp, linkpath):
+        """ True if the symlinked directory linkpath (in dp) points at dp or
+        one of its parents, which would have the scan going round in circles.
+        """
+        target = os.path.realpath(linkpath)
+        real = os.path.realpath(dp)
+        return real == target or real.startswith(target.rstrip(os.sep) + os.sep)
+
     def scan_directory_tree(self, curdir, parentid):
+        """ Brings the db up to date with the comics under curdir.
+        Every directory gets a stat, but only the ones whose mtime changed
+        since the last scan (or that are new) get listed.  An unchanged
+        directory has the same files and subdirectories as before, so its
+        subdirectories come out of the db instead.
+        - New files aren't added until the walk's done, so a comic that moved
+          can be matched up with where it went missing from, wherever that
+          is in the tree.
+        """
         log.debug("Scanning comic dir: %s" % curdir)
         self.delete_stale_directory_entries()
+        self._scan_trees([(os.path.normpath(curdir), parentid)])
+
+    def rescan_directories(self, curdir, paths):
+        """ Like scan_directory_tree(curdir, 0), but only for the trees under
+        paths (ie: the directories the watcher saw something happen in).
+        paths are always listed, whatever their mtimes say.  One that isn't
+        in the db yet gets found by rescanning its closest known parent.
+        """
+        curdir = os.path.normpath(curdir)
+        self.delete_stale_directory_entries()
+        if curdir not in self.dir_cache:
+            self._scan_trees([(curdir, 0)])
+            return
+
+        roots = set()
+        for p in paths:
+            p = os.path.normpath(p)
+            if p != curdir and not p.startswith(curdir + os.sep):
+                continue
+            while p != curdir and p not in self.dir_cache:
+                p = os.path.dirname(p)
+            roots.add(p)
+
+        # Nothing that's already under another one of the roots.
+        starts = []
+        for p in sorted(roots):
+            if len(starts) > 0 and (p + os.sep).startswith(starts[-1].rstrip(os.sep) + os.sep):
+                continue
+            starts.append(p)
+
+        if len(starts) == 0:
+            return
+
+        log.debug("Rescanning %s", ', '.join(starts))
+        self._scan_trees([(p, self.dir_info[self.dir_cache[p]][0]) for p in starts],
+                         partial=True)
+
+    def _probe_dir(self, p, mtime, known):
+        """ Runs in the scan's threads, so it only looks: stats p, and lists
+        it unless its mtime is still mtime.
+        - known is the filenames the db already has in p, the rest get
+          their sizes looked up (from the listing, where the OS has them).
+        - Returns (stat, subdirs, comics).  stat is None if p is gone, and
+          subdirs and comics are None if p wasn't listed.  comics is
+          [(filename, path, size), ...], size being None for known ones.
+        """
+        try:
+            st = os.stat(p)
+        except OSError:
+            return (None, None, None)
+
+        if mtime is not None and st.st_mtime == mtime:
+            return (st, None, None)
+
+        subdirs = []
+        comics = []
+        try:
+            with os.scandir(p) as it:
+                for ent in it:
+                    if ent.is_dir():
+                        if ent.is_symlink() and self._links_up(p, ent.path):
+                            log.warning("Skipping %s, it links back up the tree.", ent.path)
+                            continue
+                        subdirs.append(os.path.normpath(ent.path))
+                        continue
+                    tmpfn, tmpext = os.path.splitext(ent.name)
+                    if not tmpext.lower() in ['.cbr', '.cbz']:
+                        continue
+                    filebytes = None
+                    if ent.name not in known:
+                        try:
+                            filebytes = ent.stat().st_size
+                        except OSError:
+                            log.warning("Unable to stat %s", ent.path)
+                            continue
+                    comics.append((ent.name, ent.path, filebytes))
+        except OSError:
+            log.warning("Unable to list %s", p)
+            return (st, None, None)
+
+        return (st, subdirs, comics)
+
+    def _scan_trees(self, starts, partial=False):
+        """ Walks the trees starting at starts, [(path, parentid), ...], and
+        adds, moves and purges comics to match (see scan_directory_tree()).
+        - With partial, the starts are listed even if they look unchanged,
+          and only directories under them can be found to have gone missing.
+        """
+        con = sqlite3.connect(self.dbpath, isolation_level='DEFERRED')
+        try:
+            purge = self._scan_walk(con, starts, partial)
+        finally:
+            con.close()
+
+        # Only a complete walk says for sure what's missing.
+        if purge:
+            self.purge_missing_comics()
+
+    def _scan_walk(self, con, starts, partial):
+        """ The guts of _scan_trees(), writing to the db on con.  Returns
+        True if what went missing should be purged.
+        """
+        self._scan_rows = 0
         num_fn_added = 0
-        with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
-            for dirpath, dirnames, filenames in os.walk(curdir, topdown=False, followlinks=True):
-                addfns = []
-                p = os.path.normpath(dirpath)
-                if p not in self.dir_cache:
-                    curdirid = self.add_dir_entry(parentid, p)
-                    self.dir_cache[p] = curdirid
-                else:
-                    curdirid = self.dir_cache[p]
+        num_fn_moved = 0
+        num_listed = 0
+        completed = True
+        started = time.time()
+
+        seen = set()
+        newfns = {}
+        mtimes = {}
+        gone = set()
+        reparent = []
+        pending = deque(starts)
+        inflight = {}
+        force = set(p for p, pid in starts) if partial else set()
+        empty = set()
+        nthreads = max(1, gazee.config.SCAN_THREADS)
+
+        # Directories are stat'ed and listed by a pool of threads, since on
+        # a network share every one of those is a round trip.  Everything
+        # else happens here, as their results come in.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=nthreads) as ex:
+            while len(pending) > 0 or len(inflight) > 0:
+                while len(pending) > 0 and len(inflight) < nthreads * 4:
+                    p, pid = pending.pop()
+                    did = self.dir_cache.get(p)
+                    mtime = None
+                    known = ()
+                    if did is not None:
+                        if p not in force:
+                            mtime = self.dir_info[did][1]
+                        known = self.fn_cache.in_dir(did)
+                    inflight[ex.submit(self._probe_dir, p, mtime, known)] = (p, pid)
+
+                # A listing that's slow to come back (ie: a share that's
+                # hung) mustn't keep what's been written so far locked.
+                done, notdone = concurrent.futures.wait(
+                    inflight, timeout=1 if self._scan_rows > 0 else None,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                if len(done) == 0:
+                    self._scan_flush(con)
+                    continue
 
-                for ttfn in filenames:
-                    if not isinstance(ttfn, str):
-                        ttfn = str(ttfn, 'utf-8')
-                    tmpfn, tmpext = os.path.splitext(ttfn)
-                    if not tmpext.lower() in ['.cbr','.cbz']:
+                for fut in done:
+                    p, pid = inflight.pop(fut)
+                    if not completed:
+                        # Cancelled, just waiting on the stragglers.
                         continue
 
-                    if curdirid not in self.fn_cache:
-                        self.fn_cache[curdirid] = {}
-                    if ttfn not in self.fn_cache[curdirid]:
-                        cfn = os.path.normpath(os.path.join(p, ttfn))
-                        filebytes = os.path.getsize(cfn)
-                        addfns.append((curdirid, ttfn, filebytes))
+                    if not self.jobctl.checkpoint(before_wait=lambda: self._scan_flush(con)):
+                        log.info("Directory scan cancelled.")
+                        completed = False
+                        pending.clear()
+                        for nfut in inflight:
+                            nfut.cancel()
+                        continue
 
-                if len(addfns) > 0:
-                    num_fn_added += len(addfns)
-                    sql = '''INSERT INTO all_comics(seriesid, dirid, filename, filesize) VALUES (1, ?, ?, ?)'''
-                    con.executemany(sql, addfns)
-                    con.commit()
-                    log.info("Added %d new comic files.", len(addfns))
+                    self._scan_wrote(con, 0)
+                    st, subdirs, comics = fut.result()
+                    if st is None:
+                        # Gone since its parent was listed, it'll be dropped
+                        # as stale.
+                        continue
 
-                parentid = curdirid
+                    did = self.dir_cache.get(p)
+                    if did is None:
+                        did = self._insert_dir(con, pid, p)
+                        self._scan_wrote(con, 1)
+                        self.dir_cache[p] = did
+                        self.dir_info[did] = (pid, None)
+                    elif self.dir_info[did][0] != pid:
+                        reparent.append((pid, did))
+                    seen.add(did)
+
+                    if subdirs is None:
+                        # Unchanged, or couldn't be listed.
+                        for cdid in self.dir_children.get(did, []):
+                            pending.append((self.dir_cache.path(cdid), did))
+                        continue
 
-            if (num_fn_added > 0):
-                log.info("Added %d comics" % num_fn_added)
-                
+                    num_listed += 1
+                    if len(subdirs) == 0 and len(comics) == 0:
+                        empty.add(p)
+                    for sp in subdirs:
+                        # Added right away, so that once this directory's
+                        # mtime is saved, everything under it is in the db,
+                        # even if the scan stops before getting there.
+                        if sp not in self.dir_cache:
+                            sdid = self._insert_dir(con, did, sp)
+                            self._scan_wrote(con, 1)
+                            self.dir_cache[sp] = sdid
+                            self.dir_info[sdid] = (did, None)
+                        pending.append((sp, did))
+
+                    known = self.fn_cache.in_dir(did)
+                    listed = set()
+                    for ttfn, cfn, filebytes in comics:
+                        listed.add(ttfn)
+                        if ttfn not in known:
+                            newfns.setdefault(did, []).append((ttfn, cfn, filebytes))
+
+                    goners = known.missing(listed)
+                    if len(goners) > 0:
+                        self._note_missing(did, goners)
+                        gone.add(did)
+                    # Some filesystems only keep mtimes to the second (or
+                    # two), so one that just changed could change again
+                    # without it showing.
+                    if st.st_mtime < started - 2:
+                        mtimes[did] = st.st_mtime
+
+        # Only a complete walk says which directories are gone.
+        if completed:
+            self.stale_dirs = [did for did in self.dir_info if did not in seen]
+            if partial:
+                pfxs = tuple(p.rstrip(os.sep) + os.sep for p, pid in starts)
+                self.stale_dirs = [did for did in self.stale_dirs
+                                   if (self.dir_cache.path(did) + os.sep).startswith(pfxs)]
+            for did in self.stale_dirs:
+                dp = self.dir_cache.path(did)
+                if self.dir_cache.get(dp, did) != did:
+                    log.info('Dropping duplicate entry %d for %s.', did, dp)
+                else:
+                    log.info('The pathname %s (dirid: %d) no longer exists.',
+                             dp, did)
+                self._note_missing(did, self.fn_cache.in_dir(did).ids())
+        self._load_missing_fps()
+
+        # New files only get fingerprinted here if there's something missing
+        # they could be a move of, otherwise do_fingerprint_job() gets to
+        # them later.  That's done by a pool of threads too, a few
+        # directories ahead of where the results are being used.
+        fpool = None
+        fpending = deque()
+        fprints = {}
+        if len(self.missing_fps) > 0 and len(newfns) > 0:
+            fpool = concurrent.futures.ThreadPoolExecutor(max_workers=nthreads)
+            fpending.extend((cfn, filebytes) for fns in newfns.values()
+                            for ttfn, cfn, filebytes in fns)
+
+        nbytes = 0
+        for did, fns in list(newfns.items()):
+            if not self.jobctl.checkpoint(nbytes, before_wait=lambda: self._scan_flush(con)):
+                log.info("Directory scan cancelled.")
+                completed = False
+                break
+
+            nbytes = 0
+            addfns = []
+            movfns = []
+            for ttfn, cfn, filebytes in fns:
+                movedcid = None
+                fprint = None
+                if fpool is not None:
+                    while len(fpending) > 0 and len(fprints) < nthreads * 4:
+                        fcfn, fbytes = fpending.popleft()
+                        fprints[fcfn] = fpool.submit(self._fingerprint_new, fcfn, fbytes)
+                    fprint, nread = fprints.pop(cfn).result()
+                    nbytes += nread
+                    if fprint is not None:
+                        movedcid = self.find_moved_comic(cfn, fprint)
+                if movedcid is not None:
+                    movfns.append((did, ttfn, movedcid))
+                else:
+                    addfns.append((did, ttfn, filebytes, fprint))
+
+            if len(movfns) > 0:
+                num_fn_moved += len(movfns)
+                sql = '''UPDATE all_comics SET dirid=?, filename=? WHERE comicid=?'''
+                con.executemany(sql, movfns)
+
+            if len(addfns) > 0:
+                num_fn_added += len(addfns)
+                sql = '''INSERT INTO all_comics(seriesid, dirid, filename, filesize, fingerprint) VALUES (1, ?, ?, ?, ?)'''
+                con.executemany(sql, addfns)
+                log.debug("Added %d new comic files.", len(addfns))
+            del newfns[did]
+            self._scan_wrote(con, len(movfns) + len(addfns))
+
+        if fpool is not None:
+            for fut in fprints.values():
+                fut.cancel()
+            fpool.shutdown()
+
+        purge = completed and self._purge_is_safe(starts, seen, empty, partial)
+
+        # A directory's mtime is only kept once everything in it is in
+        # the db.  If the scan stopped early, ones with comics still to
+        # add, or with comics that went missing but aren't being purged,
+        # get listed again next time.
+        keep = set(newfns)
+        if not purge:
+            keep |= gone
+            keep |= set(self.dir_cache.get(p) for p, pid in starts)
+        for did in keep:
+            mtimes.pop(did, None)
+
+        sql = '''UPDATE all_directories SET parentid=? WHERE dirid=?'''
+        con.executemany(sql, reparent)
+        sql = '''UPDATE all_directories SET mtime=? WHERE dirid=?'''
+        con.executemany(sql, [(mt, did) for did, mt in mtimes.items()])
+        con.commit()
+
+        log.info("Scanned %d directories, %d of them changed.", len(seen), num_listed)
+        if (num_fn_added > 0):
+            log.info("Added %d comics" % num_fn_added)
+        if (num_fn_moved > 0):
+            log.info("Moved %d comics" % num_fn_moved)
+
+        return purge
+
+    def _purge_is_safe(self, starts, seen, empty, partial=False):
+        """ Sanity checks what a scan's about to purge, so a share that isn't
+        mounted (or is only partly there) doesn't empty out the db.  Returns
+        False, having logged why, if it looks wrong.  Whatever went missing
+        is then kept, and looked for again next scan.
+        - With partial, the starts are directories inside the library, which
+          can quite rightly be gone or empty.  It's the library's root that
+          has to look mounted.
+        """
+        nmissing = len(self.missing_comics)
+        if nmissing == 0 and len(self.stale_dirs) == 0:
+            return True
+
+        if partial:
+            roots = set(self._library_root(self.dir_cache.get(p)) for p, pid in starts)
+            for p in roots:
+                if not self._looks_mounted(p):
+                    log.warning("%s is empty or can't be read (is it mounted?), "
+                                "not purging anything.", p)
+                    return False
+            starts = []
+
+        for p, pid in starts:
+            if self.dir_cache.get(p) not in seen:
+                log.warning("%s can't be read (is it mounted?), not purging "
+                            "anything.", p)
+                return False
+            if p in empty and nmissing > 0:
+                log.warning("%s is empty (is it mounted?), not purging %d "
+                            "missing comics.", p, nmissing)
+                return False
+
+        total = len(self.fn_cache)
+        maxpct = gazee.config.PURGE_MAX_PCT
+        if maxpct > 0 and nmissing > max(self.PURGE_MIN, total * maxpct / 100.0):
+            log.warning("%d of %d comics have gone missing, more than "
+                        "purge_max_pct (%d%%) allows, so they're being kept. "
+                        "Raise purge_max_pct if they really are gone.",
+                        nmissing, total, maxpct)
+            return False
+
+        return True
+
+    def _library_root(self, did):
+        """ The path of the top of the tree directory did is in. """
+        while self.dir_info[did][0] in self.dir_info:
+            did = self.dir_info[did][0]
+        return self.dir_cache.path(did)
+
+    def _looks_mounted(self, p):
+        """ True if p can be listed, and has something in it. """
+        try:
+            with os.scandir(p) as it:
+                for ent in it:
+                    return True
+        except OSError:
+            pass
+        return False
 
     def update_comic_image(self, cid, val, width, height):
 
@@ -336,33 +1110,327 @@ CREATE INDEX IF NOT EXISTS seriescollord on comic_series(collname ASC);'''
         
         return newseries
         
-    def find_or_add_series(self, name):
+    def _series_id(self, con, name):
+        """ The seriesid for name, added to comic_series on con if it isn't
+        there yet.  Leaves committing to the caller.  Ids are cached in
+        series_cache, which has to be cleared if con gets rolled back.
+        """
         newseries = self.collate_series(name)
-        
-        sql = '''SELECT seriesid FROM comic_series WHERE collname=?'''
-        param = (newseries, )
 
-        with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
-            for row in con.execute(sql, param):
-                return row[0]
+        sid = self.series_cache.get(newseries)
+        if sid is not None:
+            return sid
 
+        sql = '''SELECT seriesid FROM comic_series WHERE collname=?'''
+        row = con.execute(sql, (newseries, )).fetchone()
+        if row is not None:
+            sid = row[0]
+        else:
             sql = '''INSERT INTO comic_series(collname, name) VALUES (?, ?)'''
             curs = con.cursor()
-            param = (newseries, name)
-            curs.execute(sql, param)
+            curs.execute(sql, (newseries, name))
             sid = curs.lastrowid
+
+        self.series_cache[newseries] = sid
+        return sid
+
+    def _publisher_id(self, con, name):
+        """ The pubid for name, added to publishers on con if it isn't there
+        yet.  Leaves committing to the caller, and caches like _series_id().
+        """
+        if name is None:
+            return None
+
+        pubid = self.pub_cache.get(name)
+        if pubid is not None:
+            return pubid
+
+        sql = '''SELECT pubid FROM publishers WHERE name=?'''
+        row = con.execute(sql, (name, )).fetchone()
+        if row is not None:
+            pubid = row[0]
+        else:
+            sql = '''INSERT INTO publishers(name) VALUES (?)'''
+            curs = con.cursor()
+            curs.execute(sql, (name, ))
+            pubid = curs.lastrowid
+
+        self.pub_cache[name] = pubid
+        return pubid
+
+    def store_thumb_results(self, results, errors=()):
+        """ Writes everything extract_thumb collected for a batch of comics
+        (thumb, cover size, pages, page index, solid flag and ComicInfo.xml
+        metadata) in a single transaction.
+        - results is a list of (edict, series, issue), where series and issue
+          are what the filename parsed to, used when ComicInfo.xml is missing.
+        - errors is a list of the edicts of comics that failed, which get
+          marked so they aren't retried.
+        """
+        if len(results) == 0 and len(errors) == 0:
+            return
+
+        csql = '''UPDATE all_comics SET image=?, width=?, height=?, ratio=?, pages=?, solid=?, seriesid=?, issue=?, volume=?, summary=?, publisher=? WHERE comicid=?;'''
+        dsql = '''DELETE FROM comic_pages WHERE comicid=?'''
+        psql = '''INSERT INTO comic_pages(comicid, pagenum, member, header_offset, compress_size, file_size, compress_type) VALUES (?, ?, ?, ?, ?, ?, ?)'''
+        esql = '''UPDATE all_comics SET image=?, width=-1, height=-1, ratio=1.0 WHERE comicid=?;'''
+        fsql = '''DELETE FROM thumb_failures WHERE comicid=?'''
+
+        cparams = []
+        dparams = []
+        pparams = []
+        eparams = [(edict['error'], edict['cid']) for edict in errors]
+
+        try:
+            with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
+                for edict, series, issue in results:
+                    cid = edict['cid']
+                    info = edict.get('info') or {}
+
+                    if info.get('series') is not None:
+                        series = info['series']
+                    if info.get('number') is not None:
+                        issue = info['number']
+
+                    sid = self._series_id(con, series)
+                    pubid = self._publisher_id(con, info.get('publisher'))
+
+                    owidth = edict['owidth']
+                    oheight = edict['oheight']
+                    ratio = (1.0) * owidth / oheight if (oheight != 0) else 0.0
+
+                    cparams.append((edict['tpath'], owidth, oheight, ratio,
+                                    edict['num_pages'],
+                                    1 if edict['solid'] else 0, sid, issue,
+                                    info.get('volume'), info.get('summary'),
+                                    pubid, cid))
+                    dparams.append((cid, ))
+                    pparams.extend([(cid, ) + tuple(pg) for pg in edict['pages']])
+
+                con.executemany(csql, cparams)
+                con.executemany(dsql, dparams)
+                con.executemany(psql, pparams)
+                con.executemany(esql, eparams)
+                con.executemany(fsql, dparams)
+                self._record_thumb_failures(con, errors)
+                con.commit()
+        except:
+            # Ids handed out inside the rolled back transaction are bogus.
+            self.series_cache = {}
+            self.pub_cache = {}
+            raise
+
+    def _record_thumb_failures(self, con, errors):
+        """ Adds the failed extract_thumb() results in errors to the
+        thumb_failures ledger on con, pushing each one's next retry back
+        exponentially with every failed attempt.
+        """
+        now = time.time()
+        sql = '''SELECT attempts FROM thumb_failures WHERE comicid=?'''
+        usql = '''INSERT OR REPLACE INTO thumb_failures(comicid, errclass, message, attempts, last_try, next_try) VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, ?)'''
+        params = []
+
+        for edict in errors:
+            cid = edict['cid']
+            row = con.execute(sql, (cid, )).fetchone()
+            attempts = (row[0] if row is not None else 0) + 1
+            delay = min(self.THUMB_RETRY_BASE * (2 ** (attempts - 1)),
+                        self.THUMB_RETRY_MAX)
+            params.append((cid, edict.get('errclass', 'Error'),
+                           edict.get('message'), attempts, now + delay))
+
+        con.executemany(usql, params)
+
+    def requeue_failed_thumbs(self):
+        """ Puts the failed comics whose retry time has come back in line for
+        the thumb job.  Returns how many there were.
+        """
+        sql = '''UPDATE all_comics SET image=NULL WHERE comicid IN (SELECT comicid FROM thumb_failures WHERE next_try <= ?)'''
+        with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
+            num = con.execute(sql, (time.time(), )).rowcount
             con.commit()
-            return sid
 
-    def update_comic_meta(self, cid, num_pages, series, issue):
-        sid = self.find_or_add_series(series)
-        
-        sql = '''UPDATE all_comics SET seriesid=?,issue=?,pages=? WHERE comicid=?;'''
-        param = (sid, issue, num_pages, cid)
+        if num > 0:
+            log.info("Retrying %d comics that failed to thumbnail before.", num)
+        return num
+
+    def is_quarantined(self, cid):
+        """ True if comicid cid failed to thumbnail, and isn't due to be
+        retried yet.
+        """
+        sql = '''SELECT next_try FROM thumb_failures WHERE comicid=?'''
         with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
-            con.execute(sql, param)
+            row = con.execute(sql, (cid, )).fetchone()
+
+        return row is not None and row[0] > time.time()
+
+    def get_quarantined(self):
+        """ Returns the comics in the thumb_failures ledger, most attempts
+        first, as dicts for the settings page.
+        """
+        sql = '''SELECT f.comicid, d.full_dir_path || '/' || c.filename, f.errclass, f.message, f.attempts, f.last_try, f.next_try FROM thumb_failures f INNER JOIN all_comics c ON (f.comicid=c.comicid) INNER JOIN all_directories d ON (c.dirid=d.dirid) ORDER BY f.attempts DESC, f.comicid ASC'''
+        cpath = gazee.config.COMIC_PATH
+        retl = []
+
+        with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
+            for row in con.execute(sql):
+                cid, fullpath, errclass, message, attempts, last_try, next_try = row
+                retl.append({'Key': cid,
+                             'RelPath': os.path.relpath(fullpath, cpath),
+                             'Error': errclass,
+                             'Message': message,
+                             'Attempts': attempts,
+                             'LastTry': last_try,
+                             'NextTry': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(next_try))})
+        return retl
+
+    def update_comic_pages(self, cid, pages):
+        """ Replaces the page index of comicid cid with pages, the rows
+        returned by archive.page_index().
+        """
+        params = [(cid, ) + tuple(pg) for pg in pages]
+
+        with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
+            con.execute('''DELETE FROM comic_pages WHERE comicid=?''', (cid, ))
+            sql = '''INSERT INTO comic_pages(comicid, pagenum, member, header_offset, compress_size, file_size, compress_type) VALUES (?, ?, ?, ?, ?, ?, ?)'''
+            con.executemany(sql, params)
+            con.commit()
+
+    def set_comic_solid(self, cid, solid):
+        sql = '''UPDATE all_comics SET solid=? WHERE comicid=?;'''
+        with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
+            con.execute(sql, (1 if solid else 0, cid))
+            con.commit()
+
+    def is_solid(self, cid):
+        """ True if comicid cid is a solid RAR.  Those can't be read a page at
+        a time without decompressing everything before the page, every time.
+        """
+        sql = '''SELECT solid FROM all_comics WHERE comicid=?'''
+        with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
+            row = con.execute(sql, (cid, )).fetchone()
+
+        return row is not None and row[0] == 1
+
+    def get_page_index(self, cid):
+        """ Returns the stored page index rows for comicid cid as
+        (pagenum, member, header_offset, compress_size, file_size,
+        compress_type), ordered by pagenum.  Empty if it hasn't been built.
+        """
+        sql = '''SELECT pagenum, member, header_offset, compress_size, file_size, compress_type FROM comic_pages WHERE comicid=? ORDER BY pagenum ASC'''
+
+        with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
+            return con.execute(sql, (cid, )).fetchall()
+
+    def get_page_entry(self, cid, page_num):
+        """ Returns the page index row for page_num of comicid cid, clamped to
+        the pages that exist, or None if there's no index for cid.
+        """
+        if page_num < 1:
+            page_num = 1
+
+        sql = '''SELECT pagenum, member, header_offset, compress_size, file_size, compress_type FROM comic_pages WHERE comicid=? AND pagenum<=? ORDER BY pagenum DESC LIMIT 1'''
+
+        with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
+            return con.execute(sql, (cid, page_num)).fetchone()
+
+    def update_page_sizes(self, cid, sizes):
+        """ Stores the probed [(width, height), ...] of comicid cid's pages,
+        in page order.
+        """
+        params = [(w, h, cid, page) for page, (w, h) in enumerate(sizes, 1)]
+        sql = '''UPDATE comic_pages SET width=?, height=? WHERE comicid=? AND pagenum=?'''
+
+        with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
+            con.executemany(sql, params)
             con.commit()
 
+    def probe_comic_pages(self, cid, archname=None):
+        """ Reads the page sizes of comicid cid out of their image headers and
+        stores them.  Returns how many bytes that read, or None if the archive
+        couldn't be probed.
+        """
+        if archname is None:
+            archname = self.get_comic_path(cid)
+            if archname is None:
+                return None
+
+        members = [pg[1] for pg in self.get_page_index(cid)]
+        sizes, nread = probe_page_sizes_read(archname, members)
+        if sizes is None:
+            return None
+
+        self.update_page_sizes(cid, sizes)
+        return nread
+
+    def mark_pages_unprobeable(self, cid):
+        """ Gives comicid cid's unprobed pages a size of (0, 0), unknown, so
+        the background pass doesn't keep trying a book it can't open.
+        """
+        sql = '''UPDATE comic_pages SET width=0, height=0 WHERE comicid=? AND width IS NULL'''
+
+        with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
+            con.execute(sql, (cid, ))
+            con.commit()
+
+    def get_unprobed_comics(self, num, aftercid=0):
+        """ Up to num comics after comicid aftercid with pages that haven't
+        been probed, in comicid order.
+        """
+        sql = '''SELECT DISTINCT p.comicid, d.full_dir_path || '/' || c.filename FROM comic_pages p INNER JOIN all_comics c ON (p.comicid=c.comicid) INNER JOIN all_directories d ON (c.dirid=d.dirid) WHERE p.comicid > ? AND p.width IS NULL AND c.solid=0 ORDER BY p.comicid ASC LIMIT ?'''
+
+        with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
+            return con.execute(sql, (aftercid, num)).fetchall()
+
+    def do_probe_job(self):
+        """ Background pass that fills in the size of every page that hasn't
+        been probed yet, a batch of books at a time.
+        """
+        probed = 0
+        failed = 0
+        cursor = 0
+
+        while True:
+            rv = self.get_unprobed_comics(20, cursor)
+            if len(rv) == 0:
+                break
+
+            nread = 0
+            for cid, archname in rv:
+                if not self.jobctl.checkpoint(nread):
+                    log.info("Page probing cancelled after %d comics.", probed)
+                    return False
+                nread = self.probe_comic_pages(cid, archname)
+                if nread is not None:
+                    probed += 1
+                else:
+                    self.mark_pages_unprobeable(cid)
+                    failed += 1
+                    nread = 0
+                cursor = cid
+
+        log.info("Probed the page sizes of %d comics...", probed)
+        if failed > 0:
+            log.info("%d comics couldn't be probed.", failed)
+        return True
+
+    def get_page_sizes(self, cid):
+        """ Returns [(width, height), ...] for comicid cid's pages, in reading
+        order, probing them now if the background pass hasn't gotten to it.
+        Unknown sizes are (0, 0), or None for pages that weren't probed.
+        """
+        sql = '''SELECT width, height FROM comic_pages WHERE comicid=? ORDER BY pagenum ASC'''
+
+        with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
+            rows = con.execute(sql, (cid, )).fetchall()
+
+        if any(w is None for w, h in rows) and not self.is_solid(cid):
+            if self.probe_comic_pages(cid) is not None:
+                with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
+                    rows = con.execute(sql, (cid, )).fetchall()
+
+        return [(w, h) if w is not None else None for w, h in rows]
+
     def get_comic_path(self, cid):
         sql = '''SELECT comicid, d.full_dir_path || '/' || c.filename as fullpath FROM all_comics c INNER JOIN all_Directories d ON (c.dirid=d.dirid) WHERE (c.comicid=?)'''
         params = (cid, )
@@ -379,8 +1447,11 @@ CREATE INDEX IF NOT EXISTS seriescollord on comic_series(collname ASC);'''
             log.debug("CID: %d returned path: %s", comicid, tpath)
         return tpath
 
-    def get_thumb_to_process(self, batchsize=1):
-        sql = '''SELECT c.comicid, d.full_dir_path || '/' || c.filename as fullpath FROM all_comics c INNER JOIN all_Directories d ON (c.dirid=d.dirid) WHERE (c.image is null) LIMIT ?'''
+    def get_thumb_to_process(self, batchsize=1, after_cid=0):
+        """ Returns up to batchsize (comicid, path) that still need a thumb,
+        in comicid order, starting after after_cid.
+        """
+        sql = '''SELECT c.comicid, d.full_dir_path || '/' || c.filename as fullpath FROM all_comics c INNER JOIN all_Directories d ON (c.dirid=d.dirid) WHERE (c.image is null) AND (c.comicid > ?) ORDER BY c.comicid ASC LIMIT ?'''
         cid = fullpath = None
 
         with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
@@ -388,7 +1459,7 @@ CREATE INDEX IF NOT EXISTS seriescollord on comic_series(collname ASC);'''
 
             rv = []
 
-            for row in curs.execute(sql, (batchsize, )):
+            for row in curs.execute(sql, (after_cid, batchsize)):
                 cid, fullpath = row
                 rv.append((cid, fullpath))
 #        if cid is not None:
@@ -396,14 +1467,168 @@ CREATE INDEX IF NOT EXISTS seriescollord on comic_series(collname ASC);'''
 
         return rv
 
+    def prioritize_thumbs(self, cids):
+        """ Moves the comics in cids (the ones on somebody's screen) that
+        still need a thumb to the front of the thumbnail queue, ahead of the
+        background backlog.  Returns how many of them were queued.
+        """
+        cids = [cid for cid in cids if isinstance(cid, int)]
+        if len(cids) == 0:
+            return 0
+
+        sql = '''SELECT comicid FROM all_comics WHERE image IS NULL AND comicid IN (%s)''' % ','.join('?' * len(cids))
+        with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
+            need = set(row[0] for row in con.execute(sql, cids))
+
+        with self._prio_lock:
+            for cid in reversed([cid for cid in cids if cid in need]):
+                if cid in self._prio_set:
+                    self._prio.remove(cid)
+                else:
+                    self._prio_set.add(cid)
+                self._prio.appendleft(cid)
+
+        return len(need)
+
+    def _next_priority_thumb(self):
+        """ Pops the next prioritized comic that still needs a thumb off of
+        the queue.  Returns (comicid, path), or (None, None) if there isn't one.
+        """
+        sql = '''SELECT c.comicid, d.full_dir_path || '/' || c.filename as fullpath FROM all_comics c INNER JOIN all_Directories d ON (c.dirid=d.dirid) WHERE (c.image is null) AND (c.comicid=?)'''
+
+        while True:
+            with self._prio_lock:
+                if len(self._prio) == 0:
+                    return (None, None)
+                cid = self._prio.popleft()
+                self._prio_set.discard(cid)
+
+            with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
+                row = con.execute(sql, (cid, )).fetchone()
+
+            if row is not None:
+                return row
+
     def reset_unprocessed_thumbs(self):
         sql = '''UPDATE all_comics SET image=null WHERE image=''; '''
         with sqlite3.connect(self.dbpath, isolation_level='DEFERRED') as con:
             con.execute(sql)
             con.commit()
 
-    def do_thumb_job(self):
-        created = 0
+    def get_thumb_pool(self):
+        """ The workers thumbnails get made in, processes or threads going by
+        the thumb_engine setting.  They're started the first time they're
+        needed and kept until close_thumb_pool().
+        Threads share this process' ARCHIVE_POOL, and skip the forking and
+        the pickling of every job and result on the way through.  Pillow and
+        zlib let go of the GIL for the heavy lifting, so they keep up fine.
+        """
+        engine = gazee.config.THUMB_ENGINE.strip().lower()
+        if engine not in ('process', 'thread'):
+            log.warn("Unknown thumb_engine '%s', using processes.", engine)
+            engine = 'process'
+
+        if self._thumb_pool is not None and self._thumb_engine != engine:
+            self.close_thumb_pool()
+
+        if self._thumb_pool is None:
+            nproc = gazee.config.THUMB_WORKERS
+            if nproc <= 0:
+                nproc = os.cpu_count() or 4
+            log.info("Starting %d thumbnail workers (%s).", nproc, engine)
+            if engine == 'thread':
+                self._thumb_pool = ThreadPool(processes=nproc)
+            else:
+                self._thumb_pool = Pool(processes=nproc)
+            self._thumb_engine = engine
+            self._thumb_nproc = nproc
+
+        return self._thumb_pool
+
+    def close_thumb_pool(self):
+        if self._thumb_pool is not None:
+            log.info("Stopping the thumbnail workers.")
+            self._thumb_abort = True
+            self._thumb_pool.terminate()
+            self._thumb_pool.join()
+            self._thumb_pool = None
+
+    def _thumb_params(self, inflight, batchsize=20):
+        """ Yields extract_thumb() parameters for every comic without a thumb,
+        reading them from the db a batch at a time as the workers need more.
+        Prioritized comics (see prioritize_thumbs()) always go next.
+        Blocks once inflight (a semaphore) is used up, so only so many jobs
+        are ever queued up ahead of the results.
+        """
+        start_cid = self.get_job_cursor('thumbs')
+        last_cid = start_cid
+        wrapped = (start_cid == 0)
+        rv = []
+        queued = set()
+
+        if not wrapped:
+            log.info("Resuming thumbnails from cid %d", start_cid)
+
+        while True:
+            if self._thumb_abort or self.jobctl.cancelled:
+                return
+
+            cid, comicpath = self._next_priority_thumb()
+
+            if cid is None:
+                if len(rv) == 0:
+                    rv = self.get_thumb_to_process(batchsize, last_cid)
+                    if len(rv) == 0 and not wrapped:
+                        # Start over from the beginning to pick up whatever
+                        # came before where the last run left off.
+                        wrapped = True
+                        last_cid = 0
+                        rv = self.get_thumb_to_process(batchsize, last_cid)
+
+                if rv is None or len(rv) == 0:
+                    log.debug("No additional thumbs to process...")
+                    return
+
+                cid, comicpath = rv.pop(0)
+                last_cid = cid
+                self._thumb_cursor = cid
+
+            if cid in queued:
+                continue
+            queued.add(cid)
+
+            tl = self.get_thumb_reslist(cid)
+            while not inflight.acquire(timeout=1.0):
+                if self._thumb_abort or self.jobctl.cancelled:
+                    return
+            yield (comicpath, cid, tl, gazee.config.IMAGE_SCRIPT)
+
+    def _filename_meta(self, comicpath):
+        """ The (series, issue) to file a comic under going by its filename. """
+        ndict = self.fnp.parseFilename(comicpath)
+
+        if ndict is None:
+            log.warn("Unable to parse filename: %s", comicpath)
+            series = None
+        else:
+            series = ndict['series']
+            issue = ndict['issue']
+
+        if series is None:
+            tser = os.path.basename(comicpath)
+            series = ''
+            for c in tser:
+                if c in ['(', '[']:
+                    break
+                series = series + c
+
+            series = series.rstrip(' ')
+            issue = ''
+
+        return (series, issue)
+
+    def do_thumb_job(self, batchsize=20):
+        self.requeue_failed_thumbs()
         self._numrecs = self.get_all_comics_count()
         self._pending = self.get_unprocessed_comics_count()
         if self._numrecs == 0:
@@ -414,95 +1639,90 @@ CREATE INDEX IF NOT EXISTS seriescollord on comic_series(collname ASC);'''
         if self._pending == 0:
             return True
 
-        jobs_pending = 0
-
-        pool = Pool(processes=4)
-
-        while True:
-            rv = self.get_thumb_to_process(20)
-            self.last_thumb_time = time.time()
-            params = []
-
-            if rv is None or len(rv) == 0:
-                log.debug("No additional thumbs to process...")
-                break
+        pool = self.get_thumb_pool()
+        inflight = threading.BoundedSemaphore(self._thumb_nproc * 4)
+        self.last_thumb_time = time.time()
+        self._thumb_abort = False
+        stored = []
+        errors = []
+
+        try:
+            finished = self._run_thumb_jobs(pool, inflight, batchsize, stored, errors)
+        except:
+            self._thumb_abort = True
+            raise
+        finally:
+            self.store_thumb_results(stored, errors)
+
+        self.set_job_cursor('thumbs', 0 if finished else self._thumb_cursor)
+        log.info("Created %d thumbnails...", self._thumb_created)
+        self.last_thumb_time = None
+        return finished
 
-            for cid, comicpath in rv:
-                if cid is None:
-                    break
+    def _run_thumb_jobs(self, pool, inflight, batchsize, stored, errors):
+        """ Collects the thumb job's results until they run out (returns True)
+        or the job gets cancelled (returns False).
+        """
+        self._thumb_created = 0
+        self._thumb_cursor = 0
 
-                tl = []
-                iproc = os.path.join(os.path.dirname(gazee.__file__), 'imgproc')
-                iprocscr = os.path.join(iproc, "imageborder")
-                thumbsize = (gazee.config.THUMB_MAXWIDTH,
-                             gazee.config.THUMB_MAXHEIGHT)
-
-                for res in [(0, 0), thumbsize]:
-                    rx, ry = res
-                    fprc = 2 if rx == 0 else 1
-                    opath = self.get_cache_path(cid, rx, ry, fprc)
-                    tl.append((rx, ry, opath))
-
-                param = (comicpath, cid, tl, 1, iprocscr)
-                params.append(param)
-
-            jobs_pending = len(params)
-            log.debug("There are %d jobs pending.", jobs_pending)
-            results = pool.map(extract_thumb, params)
-            self._pending -= jobs_pending
-            jobs_pending = 0
-
-            for edict in results:
-                if edict is None:
-                    log.error("Task returned error.");
-                    continue
+        # Results come back as each one finishes, not a batch at a time, and
+        # get written to the db every batchsize of them.
+        it = pool.imap_unordered(extract_thumb, self._thumb_params(inflight, batchsize))
 
-                cid = edict['cid']
-                if 'error' in edict and edict['error']:
-                    log.error("CID: %s returned the error: %s.", cid, edict['error'])
-                    self.update_comic_image(cid, edict['error'], -1, -1)
-                    continue
+        while True:
+            try:
+                edict = it.next(timeout=1.0)
+            except StopIteration:
+                return True
+            except multiprocessing.TimeoutError:
+                if self.jobctl.cancelled:
+                    log.info("Thumb job cancelled.")
+                    self._thumb_abort = True
+                    return False
+                continue
 
-                num_pages = edict['num_pages']
-                owidth = edict['owidth']
-                oheight = edict['oheight']
+            self.last_thumb_time = time.time()
+            self._pending -= 1
+
+            # Holding on to the slot is what keeps more jobs from being
+            # handed out while over budget, or while somebody's reading.
+            nbytes = edict['pages'][0][3] if edict and edict.get('pages') else 0
+            running = self.jobctl.checkpoint(nbytes)
+            inflight.release()
+
+            if edict is None:
+                log.error("Task returned error.");
+            elif 'error' in edict and edict['error']:
+                log.error("CID: %s returned the error: %s.", edict['cid'], edict.get('message'))
+                errors.append(edict)
+            else:
                 thumbpath = edict['tpath']
                 comicpath = edict['path']
 
-                self.update_comic_image(cid, thumbpath, owidth, oheight)
                 log.debug("Created thumbnail: %s", thumbpath)
-                created += 1
+                self._thumb_created += 1
 
-                log.debug("%d/%d: path: %s", created, self._numrecs, comicpath)
+                log.debug("%d/%d: path: %s", self._thumb_created, self._numrecs, comicpath)
 
-                ndict = self.fnp.parseFilename(comicpath)
+                series, issue = self._filename_meta(comicpath)
+                stored.append((edict, series, issue))
 
-                if ndict is None:
-                    log.warn("Unable to parse filename: %s", comicpath)
-                    series = None
-                else:
-                    series = ndict['series']
-                    issue = ndict['issue']
-
-                if series is None:
-                    tser = os.path.basename(comicpath)
-                    series = ''
-                    for c in tser:
-                        if c in ['(', '[']:
-                            break
-                        series = series + c
-
-                    series = series.rstrip(' ')
-                    issue = ''
+            if len(stored) + len(errors) >= batchsize:
+                self.store_thumb_results(stored, errors)
+                del stored[:]
+                del errors[:]
+                self.set_job_cursor('thumbs', self._thumb_cursor)
 
-                self.update_comic_meta(cid, num_pages, series, issue)
             if self._numrecs == 0:
                 self._pct = 0.0
             else:
                 self._pct = ((self._numrecs - self._pending) / self._numrecs)
-        log.info("Created %d thumbnails...", created)
-        self.last_thumb_time = None
-        return True
+
+            if not running:
+                log.info("Thumb job cancelled.")
+                self._thumb_abort = True
+                return False
 
     def do_extract_book(self, cid, username):
         ifiles = []
@@ -527,6 +1747,58 @@ CREATE INDEX IF NOT EXISTS seriescollord on comic_series(collname ASC);'''
 
         return ifiles
 
+    def get_book_pages(self, cid):
+        """ Returns the list of page member names for comicid cid, in reading
+        order, without extracting anything.  They come from the page index,
+        which gets built here if the thumbnail pass hasn't done it yet.
+        """
+        if not isinstance(cid, int):
+            cid = int(cid, 10)
+
+        pages = self.get_page_index(cid)
+
+        if len(pages) == 0:
+            archname = self.get_comic_path(cid)
+            if archname is None:
+                return []
+
+            pages = get_page_index(archname)
+            if len(pages) > 0:
+                self.update_comic_pages(cid, pages)
+                self.set_comic_solid(cid, is_solid_archive(archname))
+
+        return [pg[1] for pg in pages]
+
+    def stream_book_page(self, cid, page_num):
+        """ Returns (member name, size, generator) for page page_num of comicid
+        cid, streamed straight out of the archive, or (None, None, None).
+        Pages stored uncompressed in a CBZ are sent as a plain byte range of
+        the .cbz file, everything else goes through archive.stream_member().
+        """
+        archname = self.get_comic_path(cid)
+        if archname is None:
+            return (None, None, None)
+
+        pg = self.get_page_entry(cid, page_num)
+        if pg is None and len(self.get_book_pages(cid)) > 0:
+            pg = self.get_page_entry(cid, page_num)
+
+        if pg is None:
+            return (None, None, None)
+
+        pagenum, member, header_offset, compress_size, file_size, compress_type = pg
+
+        if compress_type == 0 and header_offset is not None and compress_size == file_size:
+            rng = stored_member_range(archname, member, header_offset, file_size)
+            if rng is not None:
+                return (member, file_size, stream_file_range(archname, rng[0], rng[1]))
+
+        rfi, body = stream_member(archname, member)
+        if rfi is None:
+            return (None, None, None)
+
+        return (rfi.filename, rfi.file_size, body)
+
     def get_nextprev_cids(self, cid, recentonly):
         if (recentonly):
             sql = '''SELECT max(comicid) FROM all_comics WHERE comicid < ?'''
@@ -961,7 +2233,9 @@ CREATE INDEX IF NOT EXISTS seriesord on comic_series(name ASC);
 CREATE INDEX IF NOT EXISTS seriescollord on comic_series(collname ASC);'''
             con.executescript(sql)
             con.commit()
-        
+
+        # The cached ids are for series that are gone now.
+        self.series_cache = {}
         return
 
 
@@ -30,6 +30,20 @@ class gcfg(object):
                 'thumb_maxwidth': '300',
                 'thumb_maxheight': '400',
                 'image_script': '0',
+                'thumb_ladder': '600,300,150,75',
+                'thumb_workers': '0',
+                'thumb_engine': 'process',
+                'cover_wait': '10',
+                'scan_max_mbps': '0',
+                'reader_pause': '15',
+                'watch_library': '1',
+                'watch_debounce': '5',
+                'watch_scan_interval': '1440',
+                'scan_threads': '8',
+                'purge_max_pct': '25',
+                'scan_batch': '5000',
+                'stream_pages': '1',
+                'archive_pool_size': '16',
                 'mylar_db': '',
                 'ssl_key': '',
                 'ssl_cert': '',
@@ -163,7 +177,11 @@ class gcfg(object):
             v = self.cfg.get('GLOBAL', vn)
 
             if vn in ['PORT', 'COMIC_SCAN_INTERVAL', 'IMAGE_SCRIPT',
-                      'COMICS_PER_PAGE', 'THUMB_MAXWIDTH', 'THUMB_MAXHEIGHT']:
+                      'COMICS_PER_PAGE', 'THUMB_MAXWIDTH', 'THUMB_MAXHEIGHT',
+                      'STREAM_PAGES', 'ARCHIVE_POOL_SIZE', 'THUMB_WORKERS',
+                      'COVER_WAIT', 'SCAN_MAX_MBPS', 'READER_PAUSE',
+                      'WATCH_LIBRARY', 'WATCH_DEBOUNCE', 'WATCH_SCAN_INTERVAL',
+                      'SCAN_THREADS', 'PURGE_MAX_PCT', 'SCAN_BATCH']:
                 if v == '':
                     v = self.cfg.get('DEFAULT', vn)
                 v = int(v, 10)
@@ -12,9 +12,11 @@
 import os
 import logging
 from gazee.comic_db import comic_db
+from gazee.watcher import LibraryWatcher
 from cherrypy.process.plugins import SimplePlugin
 import threading
 import time
+import gazee.config
 
 log = logging.getLogger(__name__)
 
@@ -34,6 +36,8 @@ class ScanDirs(SimplePlugin):
     
     _thumb_width = None
     _thumb_height = None
+    _thumb_request = None
+    _watcher = None
 
     def __init__(self, bus, interval = 300, comic_path=None, temp_path=None, sleep = 1, thumb_width = 300, thumb_height = 400):
         SimplePlugin.__init__(self, bus)
@@ -50,6 +54,10 @@ class ScanDirs(SimplePlugin):
     def start(self):
         self.bus.subscribe('db-scanner-scan', self._do_scan)
         self.bus.subscribe('db-scan-time-get', self._get_scantime)
+        self.bus.subscribe('db-thumb-priority', self._prioritize)
+        self.bus.subscribe('db-reader-active', self._reader_active)
+        self.bus.subscribe('db-config-changed', self._config_changed)
+        self._cdb.jobctl.resume()
         self._running = True
         if not self._thread:
             self._thread = threading.Thread(target=self._loop)
@@ -60,12 +68,24 @@ class ScanDirs(SimplePlugin):
         self.bus.log("Freeing scanDirs plugin...")
         self.bus.unsubscribe('db-scanner-scan', self._do_scan)
         self.bus.unsubscribe('db-scan-time-get', self._get_scantime)
+        self.bus.unsubscribe('db-thumb-priority', self._prioritize)
+        self.bus.unsubscribe('db-reader-active', self._reader_active)
+        self.bus.unsubscribe('db-config-changed', self._config_changed)
         self._running = False
+        # Have whatever job is running stop at the next item, instead of
+        # waiting for it to work through the whole backlog.
+        self._cdb.jobctl.cancel()
 
         if self._thread:
             self._thread.join()
             self._thread = None
 
+        self._cdb.close_thumb_pool()
+        self._cdb.close_cover_pool()
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
+
     def exit(self):
         self.unsubscribe()
 
@@ -73,20 +93,33 @@ class ScanDirs(SimplePlugin):
         while self._running:
             try:
                 self._scan_start = time.time()
-                self._request_scan = time.time() + self._interval
-                self.bus.log("Scheduled %d seconds from now." % self._interval)
+                self._request_scan = time.time() + self._scan_interval()
                 self._busy = True
                 self.bus.log("Starting dir tree scanning...")
                 self._cdb.scan_directory_tree(self._comic_path, 0)
                 self.bus.log("Ended dir scanning...")
-                self.bus.log("Starting cache scanning...")
-                self._cdb.reset_missing_covers(self._thumb_width, self._thumb_height)
-                self.bus.log("Done cache scanning...")
-                self.bus.log("Starting thumb job...")
-                self._cdb.do_thumb_job()
-                self.bus.log("Ended thumb job...")
+                if self._running and self._watcher is None:
+                    self._start_watcher()
+                self.bus.log("Next full scan is %d seconds from now." %
+                             (self._request_scan - time.time()))
+                if self._running:
+                    self.bus.log("Starting cache scanning...")
+                    self._cdb.reset_missing_covers(self._thumb_width, self._thumb_height)
+                    self.bus.log("Done cache scanning...")
+                if self._running:
+                    self.bus.log("Starting thumb job...")
+                    self._cdb.do_thumb_job()
+                    self.bus.log("Ended thumb job...")
+                if self._running:
+                    self.bus.log("Starting page probe job...")
+                    self._cdb.do_probe_job()
+                    self.bus.log("Ended page probe job...")
+                if self._running:
+                    self._cdb.do_fingerprint_job()
                 bpath = os.path.join(self._temp_path, 'Books')
-                for username in os.listdir(bpath):
+                if not os.path.isdir(bpath):
+                    bpath = None
+                for username in (os.listdir(bpath) if bpath else []):
                     self.bus.log("Beginning tempdir clean of user: %s..." % username)
                     opath = os.path.join(bpath, username)
                     self._cdb.clean_out_tempspace(opath, 10)
@@ -99,7 +132,100 @@ class ScanDirs(SimplePlugin):
             self._scan_start = None
 
             while self._running and time.time() < self._request_scan:
-                time.sleep(self._sleep)
+                if self._thumb_request:
+                    self._do_priority_thumbs()
+                if self._watcher is not None:
+                    self._watch()
+                else:
+                    time.sleep(self._sleep)
+
+    def _scan_interval(self):
+        """ How long until the next full scan.  With the watcher running,
+        those are only a safety net, for changes it can't see (other hosts
+        writing to a network share, say).
+        """
+        if self._watcher is not None:
+            return max(self._interval, gazee.config.WATCH_SCAN_INTERVAL * 60)
+        return self._interval
+
+    def _start_watcher(self):
+        if not gazee.config.WATCH_LIBRARY:
+            return
+
+        watcher = LibraryWatcher(gazee.config.WATCH_DEBOUNCE)
+        if watcher.start(self._cdb.get_directory_paths()):
+            self._watcher = watcher
+            self._request_scan = self._scan_start + self._scan_interval()
+
+    def _watch(self):
+        """ Waits a little while for library changes, and rescans the
+        directories that had some once they settle down.
+        """
+        self._watcher.poll(self._sleep)
+
+        if self._watcher.overflowed:
+            # Lost track of what changed, so scan the lot.
+            self._watcher.close()
+            self._watcher = None
+            self._request_scan = time.time()
+            return
+
+        dirs = self._watcher.changed()
+        if len(dirs) == 0:
+            return
+
+        try:
+            self._busy = True
+            self._scan_start = time.time()
+            self.bus.log("Rescanning %d changed directories..." % len(dirs))
+            self._cdb.rescan_directories(self._comic_path, dirs)
+            if self._running:
+                self._cdb.do_thumb_job()
+            if self._running:
+                # So they can be matched up if they're moved again.
+                self._cdb.do_fingerprint_job()
+            self.bus.log("Ended rescan of changed directories.")
+        except:
+            self.bus.log("Error rescanning changed directories.", level = logging.ERROR, traceback = True)
+
+        self._busy = False
+        self._scan_start = None
+
+    def _do_priority_thumbs(self):
+        """ Runs the thumb job between scans, because somebody's looking at
+        comics that don't have covers yet.
+        """
+        self._thumb_request = False
+        try:
+            self._busy = True
+            self._scan_start = time.time()
+            self.bus.log("Starting prioritized thumb job...")
+            self._cdb.do_thumb_job()
+            self.bus.log("Ended prioritized thumb job...")
+        except:
+            self.bus.log("Error in prioritized thumb job.", level = logging.ERROR, traceback = True)
+
+        self._busy = False
+        self._scan_start = None
+
+    def _reader_active(self, cid):
+        """ Bus handler for 'db-reader-active', published for every page read.
+        """
+        self._cdb.jobctl.reader_active()
+
+    def _config_changed(self):
+        """ Bus handler for 'db-config-changed', published when the settings
+        are saved, so the jobs' throttling follows them without a restart.
+        """
+        self._cdb.jobctl.configure(gazee.config.SCAN_MAX_MBPS,
+                                   gazee.config.READER_PAUSE)
+
+    def _prioritize(self, cids):
+        """ Bus handler for 'db-thumb-priority', cids being the comics that
+        were just put up on somebody's screen.
+        """
+        if self._cdb.prioritize_thumbs(cids) > 0:
+            self._thumb_request = True
 
     def _do_scan(self, arg):
         self._comic_path, self._temp_path, self._interval = arg
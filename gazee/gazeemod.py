@@ -28,6 +28,7 @@ from mako import exceptions
 import gazee.config
 from gazee.comic_db import comic_db
 from gazee.gazee_settings_db import gazee_settings
+from gazee.archive import image_mime_type, ARCHIVE_POOL
 
 log = logging.getLogger(__name__)
 
@@ -46,6 +47,7 @@ class Gazeesrv(object):
         self._pct = None
         self.root_dir = os.path.realpath(os.path.dirname(gazee.__file__))
         self.templates_dir = os.path.join(self.root_dir, "templates")
+        ARCHIVE_POOL.resize(gazee.config.ARCHIVE_POOL_SIZE)
 
     def serve_template(self, templatename, **kwargs):
         """
@@ -101,6 +103,21 @@ class Gazeesrv(object):
             l = i
         return rangeWithDots
         
+    def _prioritize_covers(self, comics):
+        """ Asks the scanner to make covers for the comics about to be shown
+        (from get_comics() and friends) before anything else.
+        """
+        cids = []
+        for ent in comics:
+            if isinstance(ent, list):
+                cids.extend(e.get('ComicID', e.get('Key')) for e in ent if isinstance(e, dict))
+            elif isinstance(ent, dict):
+                cids.append(ent.get('ComicID', ent.get('Key')))
+
+        cids = [cid for cid in cids if isinstance(cid, int)]
+        if len(cids) > 0:
+            self.bus.publish('db-thumb-priority', cids)
+
     @cherrypy.expose
     def library(self, page_num=1, async=False):
         if page_num == '':
@@ -126,6 +143,7 @@ class Gazeesrv(object):
             page_num = 1
 
         comics = self.cdb.get_series(comics_per_page, page_num)
+        self._prioritize_covers(comics)
         num_comics, num_recent, bytes_str, num_unprocessed, total_unprocsize = self.cdb.get_comics_stats()
 
         pages = self.pag(page_num, num_of_pages)
@@ -183,6 +201,7 @@ class Gazeesrv(object):
         pages = self.pag(cur_page, num_of_pages)
         
         comics = self.cdb.get_series_onepage(comics_per_page, load_page)
+        self._prioritize_covers(comics)
                                             
         pstr = self.serve_template(templatename="pagination.html",
                                    pages=pages,
@@ -232,6 +251,7 @@ class Gazeesrv(object):
             page_num = 1
 
         comics = self.cdb.get_comics(7, comics_per_page, page_num, series_id, recentonly=recent)
+        self._prioritize_covers(comics)
         num_comics, num_recent, bytes_str, num_unprocessed, total_unprocsize = self.cdb.get_comics_stats()
 
         pages = self.pag(page_num, num_of_pages)
@@ -294,6 +314,7 @@ class Gazeesrv(object):
 
         comics = self.cdb.get_comics_onepage(7, comics_per_page, load_page, series_id, 
                                             recentonly=recent)
+        self._prioritize_covers(comics)
                                             
         pstr = self.serve_template(templatename="pagination.html",
                                    pages=pages,
@@ -333,6 +354,18 @@ class Gazeesrv(object):
         log.debug(d)
         return json.dumps(d)
 
+    @cherrypy.expose
+    def page_sizes(self, cid=-1):
+        """ Returns JSON list of [width, height] for each page of comicid cid,
+        so the reader can lay pages out (and spot spreads) before they load.
+        """
+        if not isinstance(cid, int):
+            cid = int(cid, 10)
+
+        sizes = self.cdb.get_page_sizes(cid)
+        d = {'Pages': [list(sz) if sz is not None else None for sz in sizes]}
+        return json.dumps(d)
+
     @cherrypy.expose
     def search(self, page_num=1, search_string=''):
         """
@@ -353,8 +386,9 @@ class Gazeesrv(object):
 
 
     @cherrypy.expose
-    def cover(self, cid=-1):
-        """ Returns the cover thumbnail for comicid <id>
+    def cover(self, cid=-1, wid=0):
+        """ Returns the cover thumbnail for comicid <id>, or the smallest of
+        the thumb_ladder sizes that's at least <wid> pixels wide.
         """
         if (cid == ''):
             return
@@ -367,19 +401,25 @@ class Gazeesrv(object):
             
         log.debug("In /cover for cid=%d", cid)
 
-        cpath = self.cdb.get_cache_path(cid, gazee.config.THUMB_MAXWIDTH,
-                                        gazee.config.THUMB_MAXHEIGHT)
+        if not isinstance(wid, int):
+            wid = int(wid, 10)
+
+        cpath = self.cdb.get_cover_path(cid, wid)
 #        log.info("Looking for the cover %d in directory: %s" % (cid, cpath))
+        if not os.path.exists(cpath):
+#            log.warning("Cover %d is missing!", cid)
+            # Make just this one cover now, rather than sending back nothing.
+            if self.cdb.make_cover_wait(cid, gazee.config.COVER_WAIT):
+                cpath = self.cdb.get_cover_path(cid, wid)
+            else:
+                self.bus.publish('db-thumb-priority', [cid])
+
         if os.path.exists(cpath):
             cherrypy.response.headers['Content-Type'] = 'image/jpeg'
             fsize = os.path.getsize(cpath)
 #            log.debug("Cover file #%d is %d bytes.", cid, fsize)
             with open(cpath, 'rb') as imgfd:
                 return imgfd.read()
-        else:
-#            log.warning("Cover %d is missing!", cid)
-            self.cdb.reset_missing_covers(gazee.config.THUMB_MAXWIDTH,
-                                          gazee.config.THUMB_MAXHEIGHT)
     
     @cherrypy.expose
     def start_uncompress(self, cid):
@@ -402,18 +442,24 @@ class Gazeesrv(object):
         if not isinstance(cid, int):
             cid = int(cid, 10)
 
-        opath = "%s/Books/%s/%d" % (gazee.config.TEMP_DIR, username, cid)
-        arg = (self.cdb.get_comic_path(cid), opath, cid, 3)
-        restup = self.bus.publish('files-uncompress', arg)
-
         if not isinstance(page_num, int):
             page_num = int(page_num, 10)
 
-        if not os.path.exists(opath):
-            os.makedirs(opath, 0o755)
-            image_list = []
+        if gazee.config.STREAM_PAGES:
+            # Pages get pulled out of the archive one at a time by read_page
+            image_list = self.cdb.get_book_pages(cid)
 
-        image_list = self.cdb.do_extract_book(cid, username)
+        if not gazee.config.STREAM_PAGES or self.cdb.is_solid(cid):
+            # Solid RARs get unpacked in one pass up front instead.
+            opath = "%s/Books/%s/%d" % (gazee.config.TEMP_DIR, username, cid)
+            arg = (self.cdb.get_comic_path(cid), opath, cid, 3)
+            restup = self.bus.publish('files-uncompress', arg)
+
+            if not os.path.exists(opath):
+                os.makedirs(opath, 0o755)
+                image_list = []
+
+            image_list = self.cdb.do_extract_book(cid, username)
         num_pages = len(image_list)
 
         if num_pages == 0:
@@ -459,6 +505,20 @@ class Gazeesrv(object):
         if not isinstance(page_num, int):
             page_num = int(page_num, 10)
 
+        # Background jobs back off while somebody's reading.
+        self.bus.publish('db-reader-active', cid)
+
+        if gazee.config.STREAM_PAGES and not self.cdb.is_solid(cid):
+            member, size, body = self.cdb.stream_book_page(cid, page_num)
+            if member is None:
+                log.error("Unable to stream page %d of cid %d", page_num, cid)
+                return "fail"
+
+            cherrypy.response.headers['Content-Type'] = image_mime_type(member)
+            cherrypy.response.headers['Content-Length'] = str(size)
+            cherrypy.response.stream = True
+            return body
+
         opath = "%s/Books/%s/%d" % (gazee.config.TEMP_DIR, username, cid)
 
         if not os.path.exists(opath):
@@ -479,15 +539,7 @@ class Gazeesrv(object):
 
         gfile = image_list[page_num - 1]
 
-        imgt = ""
-        if gfile.endswith('.jpg'):
-            imgt = "jpeg"
-        elif gfile.endswith('.png'):
-            imgt = "png"
-        elif (gfile.endswith('.gif')):
-            imgt = "gif"
-
-        cherrypy.response.headers['Content-Type'] = 'image/%s' % imgt
+        cherrypy.response.headers['Content-Type'] = image_mime_type(gfile)
         with open(gfile, 'rb') as imgfd:
             return imgfd.read()
 
@@ -530,6 +582,13 @@ class Gazeesrv(object):
              'scanInterval': gazee.config.COMIC_SCAN_INTERVAL}
         return json.dumps(d)
 
+    @cherrypy.expose
+    def quarantined(self):
+        """ Returns JSON list of the comics that won't thumbnail, with why,
+        and when they'll next be tried.
+        """
+        return json.dumps(self.cdb.get_quarantined())
+
 #    @cherrypy.tools.accept(media='text/plain')
 
     @cherrypy.expose
@@ -560,6 +619,7 @@ class Gazeesrv(object):
                     'bind_address': baval}}
 
         self.gcfg.updateCfg(newvals)
+        self.bus.publish('db-config-changed')
         log.info("Settings Saved")
         return self.load_settings()
 #        self.restart()
@@ -0,0 +1,118 @@
+# .oooooooo  .oooo.     oooooooo  .ooooo.   .ooooo.
+# 888' `88b  `P  )88b   d'""7d8P  d88' `88b d88' `88b
+# 888   888   .oP"888     .d8P'   888ooo888 888ooo888
+# `88bod8P'  d8(  888   .d8P'  .P 888    .o 888    .o
+# `8oooooo.  `Y888""8o d8888888P  `Y8bod8P' `Y8bod8P'
+# d"     YD
+# "Y88888P'
+#
+# background job control
+#
+
+"""
+What the background jobs (scan, thumbs, page probes...) check in with between
+items: whether they've been cancelled, whether they're reading faster than
+they're allowed to, and whether somebody's reading a comic right now, in
+which case they sit tight until the reader's been idle for a while.
+"""
+
+import time
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class JobControl(object):
+    """ Shared between the background jobs and whatever wants to stop or
+    slow them down.
+    - max_mbps: how many MB/s the jobs may read, 0 for no limit.
+    - reader_pause: seconds the jobs hold off after a page gets read, 0 to
+      never hold off.
+    """
+    def __init__(self, max_mbps=0, reader_pause=0):
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._last_read = None
+        self._bucket_start = time.time()
+        self._bucket_bytes = 0
+        self.configure(max_mbps, reader_pause)
+
+    def configure(self, max_mbps, reader_pause):
+        self.max_mbps = max_mbps
+        self.reader_pause = reader_pause
+
+    def cancel(self):
+        self._cancel.set()
+
+    def resume(self):
+        self._cancel.clear()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def reader_active(self):
+        """ Called whenever somebody reads a page. """
+        self._last_read = time.time()
+
+    def _reader_wait(self):
+        if self.reader_pause <= 0 or self._last_read is None:
+            return 0
+        return (self._last_read + self.reader_pause) - time.time()
+
+    def _budget_wait(self, nbytes):
+        if self.max_mbps <= 0:
+            return 0
+
+        with self._lock:
+            now = time.time()
+            # Start a new accounting window every so often, so an idle spell
+            # doesn't bank a burst of unthrottled reading.
+            if now - self._bucket_start > 10:
+                self._bucket_start = now
+                self._bucket_bytes = 0
+            self._bucket_bytes += nbytes
+            allowed = (now - self._bucket_start) * self.max_mbps * 1048576
+            return (self._bucket_bytes - allowed) / (self.max_mbps * 1048576)
+
+    def _sleep(self, secs):
+        """ Sleeps up to secs, waking early if cancelled.  Returns False if
+        it was.
+        """
+        return not self._cancel.wait(secs)
+
+    def checkpoint(self, nbytes=0, before_wait=None):
+        """ Jobs call this between items, with how many bytes they read for
+        the last one.  Sleeps as long as it takes to keep inside the budget
+        and out of readers' way.
+        - before_wait, if given, is called once before any sleeping (ie: to
+          commit, so the job doesn't hold the db locked while it waits).
+        - Returns False if the job has been cancelled and should stop.
+        """
+        if self.cancelled:
+            return False
+
+        wait = self._budget_wait(nbytes)
+        if wait > 0:
+            if before_wait is not None:
+                before_wait()
+                before_wait = None
+            if not self._sleep(wait):
+                return False
+
+        paused = False
+        while True:
+            wait = self._reader_wait()
+            if wait <= 0:
+                break
+            if not paused:
+                log.debug("Pausing background jobs while comics are being read.")
+                paused = True
+                if before_wait is not None:
+                    before_wait()
+                    before_wait = None
+            if not self._sleep(min(wait, 1.0)):
+                return False
+
+        return not self.cancelled
@@ -0,0 +1,189 @@
+# .oooooooo  .oooo.     oooooooo  .ooooo.   .ooooo.
+# 888' `88b  `P  )88b   d'""7d8P  d88' `88b d88' `88b
+# 888   888   .oP"888     .d8P'   888ooo888 888ooo888
+# `88bod8P'  d8(  888   .d8P'  .P 888    .o 888    .o
+# `8oooooo.  `Y888""8o d8888888P  `Y8bod8P' `Y8bod8P'
+# d"     YD
+# "Y88888P'
+#
+# compact path indexes
+#
+
+"""
+What the scan knows is in the db, kept as sorted arrays of 64-bit string
+hashes with the ids alongside, instead of dicts full of path and filename
+strings.  A big library's worth comes to a few tens of MB rather than
+hundreds, and lookups are a bisect.
+
+The hashes are Python's own hash(), so they're only good for the life of
+the process, which is all these are: they get rebuilt from the db at the
+start of every scan.  Directory paths are kept too, packed into one bytes
+blob, since the scan needs them back by id.  Filenames aren't, so two would
+have to hash the same, in the same directory, to get mixed up.
+"""
+
+from array import array
+from bisect import bisect_left
+
+
+def _encode(key):
+    # surrogatepass round trips anything os.fsdecode() can hand back.
+    return key.encode('utf-8', 'surrogatepass')
+
+
+class PathIndex(object):
+    """ Maps strings (ie: directory paths) to ids, like a dict would, and
+    ids back to their strings with path().  Whatever's added after it's
+    built goes in plain dicts on the side, that's only ever a scan's worth
+    of new directories.
+    """
+    def __init__(self, items=()):
+        """ items is [(key, id), ...], the first id wins for a repeated key
+        (the others can still be looked up with path()).
+        """
+        hashes = array('q')
+        self._ids = array('q')
+        self._offs = array('q', [0])
+        blob = bytearray()
+        for key, kid in items:
+            hashes.append(hash(key))
+            self._ids.append(kid)
+            blob += _encode(key)
+            self._offs.append(len(blob))
+        self._blob = bytes(blob)
+        del blob
+
+        # Stable, so the first of any repeats comes first.  _rows is where
+        # each hash's key and id are, in the order they were given.
+        order = sorted(range(len(hashes)), key=hashes.__getitem__)
+        self._hashes = array('q', (hashes[i] for i in order))
+        self._rows = array('q', order)
+        del hashes
+
+        order = sorted(range(len(self._ids)), key=self._ids.__getitem__)
+        self._byid = array('q', (self._ids[i] for i in order))
+        self._idrows = array('q', order)
+
+        self._extra = {}
+        self._extra_keys = {}
+
+    def _key(self, row):
+        return self._blob[self._offs[row]:self._offs[row + 1]]
+
+    def get(self, key, default=None):
+        kid = self._extra.get(key)
+        if kid is not None:
+            return kid
+
+        h = hash(key)
+        i = bisect_left(self._hashes, h)
+        bkey = None
+        while i < len(self._hashes) and self._hashes[i] == h:
+            row = self._rows[i]
+            if bkey is None:
+                bkey = _encode(key)
+            if self._key(row) == bkey:
+                return self._ids[row]
+            i += 1
+        return default
+
+    def path(self, kid, default=None):
+        """ The key id was given with, the reverse of get(). """
+        key = self._extra_keys.get(kid)
+        if key is not None:
+            return key
+
+        i = bisect_left(self._byid, kid)
+        if i < len(self._byid) and self._byid[i] == kid:
+            return self._key(self._idrows[i]).decode('utf-8', 'surrogatepass')
+        return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        kid = self.get(key)
+        if kid is None:
+            raise KeyError(key)
+        return kid
+
+    def __setitem__(self, key, kid):
+        self._extra[key] = kid
+        self._extra_keys[kid] = key
+
+    def __len__(self):
+        return len(self._hashes) + len(self._extra)
+
+
+class FileIndex(object):
+    """ Which filenames each directory has, and their ids (ie: comicids),
+    sorted by directory then filename hash.
+    """
+    def __init__(self, rows=()):
+        """ rows is [(dirid, id, filename), ...] in dirid order. """
+        self._dids = array('q')
+        self._starts = array('q')
+        self._hashes = array('q')
+        self._ids = array('q')
+
+        group = []
+        for did, fid, fn in rows:
+            if len(self._dids) > 0 and did == self._dids[-1]:
+                group.append((hash(fn), fid))
+                continue
+            if len(self._dids) > 0 and did < self._dids[-1]:
+                raise ValueError("FileIndex rows aren't in dirid order")
+            self._add_group(group)
+            group = [(hash(fn), fid)]
+            self._dids.append(did)
+            self._starts.append(len(self._hashes))
+        self._add_group(group)
+        self._starts.append(len(self._hashes))
+
+    def _add_group(self, group):
+        group.sort()
+        for h, fid in group:
+            self._hashes.append(h)
+            self._ids.append(fid)
+
+    def in_dir(self, did):
+        """ The files in directory did, as a DirFiles. """
+        i = bisect_left(self._dids, did)
+        if i < len(self._dids) and self._dids[i] == did:
+            return DirFiles(self, self._starts[i], self._starts[i + 1])
+        return DirFiles(self, 0, 0)
+
+    def __len__(self):
+        return len(self._hashes)
+
+
+class DirFiles(object):
+    """ One directory's slice of a FileIndex. """
+    def __init__(self, index, lo, hi):
+        self._index = index
+        self._lo = lo
+        self._hi = hi
+
+    def get(self, fn, default=None):
+        hashes = self._index._hashes
+        h = hash(fn)
+        i = bisect_left(hashes, h, self._lo, self._hi)
+        if i < self._hi and hashes[i] == h:
+            return self._index._ids[i]
+        return default
+
+    def __contains__(self, fn):
+        return self.get(fn) is not None
+
+    def __len__(self):
+        return self._hi - self._lo
+
+    def ids(self):
+        return list(self._index._ids[self._lo:self._hi])
+
+    def missing(self, names):
+        """ The ids of the files that aren't in names. """
+        hs = set(hash(fn) for fn in names)
+        hashes = self._index._hashes
+        ids = self._index._ids
+        return [ids[i] for i in range(self._lo, self._hi) if hashes[i] not in hs]
@@ -0,0 +1,271 @@
+# .oooooooo  .oooo.     oooooooo  .ooooo.   .ooooo.
+# 888' `88b  `P  )88b   d'""7d8P  d88' `88b d88' `88b
+# 888   888   .oP"888     .d8P'   888ooo888 888ooo888
+# `88bod8P'  d8(  888   .d8P'  .P 888    .o 888    .o
+# `8oooooo.  `Y888""8o d8888888P  `Y8bod8P' `Y8bod8P'
+# d"     YD
+# "Y88888P'
+#
+# library change watcher
+#
+
+"""
+Watches the comic library with Linux's inotify (through ctypes, there's
+nothing to install) and keeps track of which directories have had comics
+or subdirectories come and go, so just those can be rescanned.
+
+inotify only sees changes made through the local kernel: on an NFS or SMB
+mount, changes made from other machines don't show up, which is why the
+full scans still run now and then.
+"""
+
+import os
+import sys
+import time
+import errno
+import struct
+import select
+import ctypes
+import ctypes.util
+import logging
+
+log = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+# IN_MODIFY too, so a comic that's still being copied in keeps pushing
+# its directory's rescan back.
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+EVENT_HDR = struct.Struct('iIII')
+COMIC_EXTS = ('.cbr', '.cbz')
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        _libc = libc
+
+    return _libc
+
+
+def inotify_available():
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        libc = _get_libc()
+        return hasattr(libc, 'inotify_init1')
+    except (OSError, AttributeError):
+        return False
+
+
+class LibraryWatcher(object):
+    """ Watches every directory it's given (plus whatever gets created under
+    them) and hands back the ones that changed once they've been quiet for
+    debounce seconds, so a comic being copied in, or a whole folder of them,
+    gets picked up in one go.
+    """
+    def __init__(self, debounce=5):
+        self.debounce = debounce
+        self.overflowed = False
+        self._fd = None
+        self._wds = {}
+        self._paths = {}
+        self._dirty = {}
+
+    def start(self, paths):
+        """ Starts watching paths.  Returns False (having logged why) if
+        inotify isn't there, or runs out of watches.
+        """
+        if not inotify_available():
+            log.info("inotify isn't available, the library will be polled.")
+            return False
+
+        libc = _get_libc()
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            log.warning("inotify_init1 failed: %s", os.strerror(ctypes.get_errno()))
+            return False
+        self._fd = fd
+
+        for p in paths:
+            if not self._add_watch(p):
+                self.close()
+                return False
+
+        log.info("Watching %d directories for changes.", len(self._wds))
+        return True
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = None
+        self._wds = {}
+        self._paths = {}
+
+    def _add_watch(self, p):
+        """ Returns False if the watch couldn't be added for a reason that
+        means no more can be, either.
+        """
+        wd = _get_libc().inotify_add_watch(self._fd, os.fsencode(p), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                log.warning("Ran out of inotify watches at %s, raise "
+                            "fs.inotify.max_user_watches to watch the whole "
+                            "library.", p)
+                return False
+            # Gone, or not a directory any more, the scan sorts that out.
+            log.debug("Unable to watch %s: %s", p, os.strerror(err))
+            return True
+
+        old = self._wds.get(wd)
+        if old is not None and old != p:
+            if os.path.isdir(old):
+                # The same directory by another path (ie: a symlink to it),
+                # the one it's watched as already is kept.
+                return True
+            # Moved, without the watch being dropped.
+            self._paths.pop(old, None)
+        self._wds[wd] = p
+        self._paths[p] = wd
+        return True
+
+    def _add_tree(self, top):
+        # Every directory is only gone into once, and top's parents count as
+        # already been, so a symlink back up the tree doesn't go round and
+        # round until the watches run out.
+        seen = set()
+        p = os.path.realpath(top)
+        while True:
+            try:
+                st = os.stat(p)
+                seen.add((st.st_dev, st.st_ino))
+            except OSError:
+                pass
+            parent = os.path.dirname(p)
+            if parent == p:
+                break
+            p = parent
+
+        for dirpath, dirnames, filenames in os.walk(top, followlinks=True):
+            keep = []
+            for dn in dirnames:
+                try:
+                    st = os.stat(os.path.join(dirpath, dn))
+                except OSError:
+                    continue
+                if (st.st_dev, st.st_ino) not in seen:
+                    seen.add((st.st_dev, st.st_ino))
+                    keep.append(dn)
+            dirnames[:] = keep
+
+            if not self._add_watch(os.path.normpath(dirpath)):
+                self.overflowed = True
+                return
+
+    def _drop_tree(self, top):
+        """ Forgets the watches on top and under it, it was moved away. """
+        pfx = top + os.sep
+        for p in [p for p in self._paths if p == top or p.startswith(pfx)]:
+            wd = self._paths.pop(p)
+            self._wds.pop(wd, None)
+            _get_libc().inotify_rm_watch(self._fd, wd)
+
+    def poll(self, timeout):
+        """ Waits up to timeout seconds for events, and notes which
+        directories they were in.
+        """
+        if self._fd is None:
+            time.sleep(timeout)
+            return
+
+        try:
+            rl, wl, xl = select.select([self._fd], [], [], timeout)
+        except InterruptedError:
+            return
+        if len(rl) == 0:
+            return
+
+        try:
+            buf = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return
+
+        now = time.time()
+        off = 0
+        while off + EVENT_HDR.size <= len(buf):
+            wd, mask, cookie, nlen = EVENT_HDR.unpack_from(buf, off)
+            name = buf[off + EVENT_HDR.size:off + EVENT_HDR.size + nlen].rstrip(b'\0')
+            off += EVENT_HDR.size + nlen
+            self._event(wd, mask, os.fsdecode(name), now)
+
+    def _event(self, wd, mask, name, now):
+        if mask & IN_Q_OVERFLOW:
+            log.warning("Missed some library changes, a full scan is needed.")
+            self.overflowed = True
+            return
+
+        dp = self._wds.get(wd)
+        if dp is None:
+            return
+
+        if mask & IN_IGNORED:
+            self._wds.pop(wd, None)
+            if self._paths.get(dp) == wd:
+                del self._paths[dp]
+            return
+
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            # The parent gets an event of its own for this.
+            return
+
+        path = os.path.join(dp, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_tree(path)
+            elif mask & IN_MOVED_FROM:
+                self._drop_tree(path)
+        elif mask & (IN_CREATE | IN_MOVED_TO) and os.path.islink(path) and os.path.isdir(path):
+            # Symlinks to directories don't come with IN_ISDIR, but the scan
+            # follows them, so what's under them gets watched too.
+            self._add_tree(path)
+        elif mask & (IN_DELETE | IN_MOVED_FROM) and path in self._paths:
+            # A symlinked directory, its target's still there to watch.
+            self._drop_tree(path)
+        elif not name.lower().endswith(COMIC_EXTS):
+            return
+
+        self._dirty[dp] = now
+
+    def changed(self):
+        """ Returns the directories that had changes, and have been quiet for
+        the last debounce seconds, and forgets about them.
+        """
+        now = time.time()
+        ready = [p for p, t in self._dirty.items() if now - t >= self.debounce]
+        for p in ready:
+            del self._dirty[p]
+        return ready